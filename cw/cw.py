@@ -1,5 +1,7 @@
 from framework import *
 from rand import *
+from functools import partial
+from replication import run_replications, run_until_precision, run_comparison, BatchMeans
 
 # The task is to:
 # - calculate average time of TechProcessGenerator to be in SLOW mode
@@ -10,14 +12,16 @@ class TechProcessGenerator(Create):
         NORMAL = 0
         SLOW = 1
 
-    def __init__(self, name, normal_delay=(8, 12), slow_delay=(16, 24)):
+    def __init__(self, name, normal_delay=(8, 12), slow_delay=(16, 24), rand=None):
         super().__init__(None, name)
         #self.name = name
+        self.rand = rand if rand is not None else Rand.default()
         self.working_mode = TechProcessGenerator.Mode.NORMAL
 
+        # own stream per mode, time spent in one mode does not shift variates of the other
         self.modes = {
-            TechProcessGenerator.Mode.NORMAL: normal_delay,
-            TechProcessGenerator.Mode.SLOW: slow_delay
+            TechProcessGenerator.Mode.NORMAL: Uniform(normal_delay[0], normal_delay[1], self.rand.stream('normal')),
+            TechProcessGenerator.Mode.SLOW: Uniform(slow_delay[0], slow_delay[1], self.rand.stream('slow'))
         }
 
         self.received_control_signal = False
@@ -33,8 +37,7 @@ class TechProcessGenerator(Create):
     def out_act(self):
         self.quantity += 1
 
-        distribution = self.modes[self.working_mode]
-        delay = Rand.uniform(distribution[0], distribution[1])
+        delay = self.modes[self.working_mode]()
         self.tnext = self.tcurr + delay
 
         if not self.received_control_signal:
@@ -59,6 +62,11 @@ class TechProcessGenerator(Create):
     def send_element_proceeded(self):
         self.received_control_signal = True
 
+    def reset_statistics(self):
+        super().reset_statistics()
+        self.slowed_mean_time_sum = 0
+        self.slowed_mean_time_quantity = 0
+
     def print_info(self):
         print(f'Name: {self.name}, \
                 Quantity: {self.quantity}, \
@@ -68,10 +76,11 @@ class TechProcessGenerator(Create):
 
 
 class MainEOM(Process):
-    def __init__(self, delay, name, reserve_eom, generator, recovery_delay=100, i_am_working_delay=30):
+    def __init__(self, delay, name, reserve_eom, generator, recovery_delay=100, i_am_working_delay=30, rand=None):
         super().__init__(delay, name, None, 1, 0)
 
-        self.shutdown_delay_f = lambda: Rand.uniform(270, 330)
+        self.rand = rand if rand is not None else Rand.default()
+        self.shutdown_delay_f = Uniform(270, 330, self.rand)
         self.recovery_delay = recovery_delay
         self.i_am_working_delay = i_am_working_delay
         self.is_shutdown = False
@@ -89,18 +98,13 @@ class MainEOM(Process):
         self.generator = generator
 
     def get_tnext(self):
-        tmp_tnext = float(sys.maxsize)
-        for device in self.devices:
-            if device.tnext < tmp_tnext:
-                tmp_tnext = device.tnext
-        
-        return min(self.tnext_shutdown, self.tnext_recovery, tmp_tnext, self.tnext_i_am_working)
+        return min(self.tnext_shutdown, self.tnext_recovery, super().get_tnext(), self.tnext_i_am_working)
 
     def in_act(self):
-        if self.get_free_device() is not None:
-            device = self.get_free_device()
-            device.state = State.BUSY
-            device.tnext = self.tcurr + self.delayMean
+        device = self.get_free_device()
+        if device is not None:
+            self.occupy_device(device, self.delayMean)
+            self.schedule()
         else:
             self.failure += 1
 
@@ -128,8 +132,7 @@ class MainEOM(Process):
             self.tnext_i_am_working = float(sys.maxsize)
 
             # expected to be one device
-            self.devices[0].tnext = float(sys.maxsize)
-            self.devices[0].state = State.FREE
+            self.release_device(self.devices[0])
 
         elif tmp_tnext == self.tnext_recovery:
             self.is_shutdown = False
@@ -145,9 +148,7 @@ class MainEOM(Process):
             if not self.is_shutdown:
                 self.quantity += 1
                 self.inform_generator_element_proceeded()
-            min_dev = self.get_min_device()
-            min_dev.state = State.FREE
-            min_dev.tnext = float(sys.maxsize)
+            self.release_device(self.get_min_device())
 
     def print_info(self):
         super().print_info()
@@ -183,20 +184,16 @@ class ReservEOM(Process):
     def main_is_alive(self):
         self.is_main_alive = True
         self.tnext_main_alive = self.tcurr + self.main_alive_delay
+        self.schedule()
 
     def get_tnext(self):
-        tmp_tnext = float(sys.maxsize)
-        for device in self.devices:
-            if device.tnext < tmp_tnext:
-                tmp_tnext = device.tnext
-        
-        return min(tmp_tnext, self.tnext_main_alive, self.tnext_started_up)
+        return min(super().get_tnext(), self.tnext_main_alive, self.tnext_started_up)
 
     def in_act(self):
-        if self.get_free_device() is not None and self.working_state == ReservEOM.WorkingState.ACTIVE:
-            device = self.get_free_device()
-            device.state = State.BUSY
-            device.tnext = self.tcurr + self.delayMean
+        device = self.get_free_device()
+        if device is not None and self.working_state == ReservEOM.WorkingState.ACTIVE:
+            self.occupy_device(device, self.delayMean)
+            self.schedule()
         else:
             self.failure += 1
 
@@ -223,8 +220,7 @@ class ReservEOM(Process):
             self.quantity += 1
             self.inform_generator_element_proceeded()
 
-            self.devices[0].state = State.FREE
-            self.devices[0].tnext = float(sys.maxsize)
+            self.release_device(self.devices[0])
     
     def out_act_all(self, tcurr_next=None):
         super().out_act_all(tcurr_next)
@@ -242,19 +238,49 @@ class ReservEOM(Process):
 
 
 
-if __name__ == '__main__':
-    generator = TechProcessGenerator('Generator')
+def create_model(rand=None, started_up_delay=5, recovery_delay=100, monitors=None):
+    # streams are named by element and purpose, so configurations built from the same rand
+    # get the same variates (common random numbers)
+    rand = rand if rand is not None else Rand()
+    generator_rand = rand.stream('Generator', 'arrivals')
+    main_eom_rand = rand.stream('Main EOM', 'failures')
+
+    generator = TechProcessGenerator('Generator', rand=generator_rand)
 
-    reserve_eom = ReservEOM(3, 'Reserve EOM', generator, started_up_delay=5)
-    main_eom = MainEOM(3, 'Main EOM', reserve_eom, generator)
+    reserve_eom = ReservEOM(3, 'Reserve EOM', generator, started_up_delay=started_up_delay)
+    main_eom = MainEOM(3, 'Main EOM', reserve_eom, generator, recovery_delay=recovery_delay, rand=main_eom_rand)
 
     reserve_eom.main_eom = main_eom
     generator.main_eom = main_eom
     generator.reserve_eom = reserve_eom
 
-    model = Model([generator, reserve_eom, main_eom], debug=True, debug_delay=0)
+    return Model([generator, reserve_eom, main_eom], monitors=monitors)
+
+
+# metrics of the study, model elements are [generator, reserve_eom, main_eom]
+def average_slowed_time(model):
+    generator = model.elements[0]
+    return generator.slowed_mean_time_sum / generator.slowed_mean_time_quantity
+
+def main_failures(model):
+    return model.elements[2].failure
+
+def reserve_failures(model):
+    return model.elements[1].failure
+
+METRICS = {
+    'average generator slowed time': average_slowed_time,
+    'main failures': main_failures,
+    'reserve failures': reserve_failures,
+}
+
+
+if __name__ == '__main__':
+    model = create_model(Rand(2024))
     model.simulate(10000)
 
+    generator, reserve_eom, main_eom = model.elements
+
     print('\n')
     print(f'Stats:\n\
           \tmain failures: {main_eom.failure}\n\
@@ -262,3 +288,55 @@ if __name__ == '__main__':
           \ttotal failures: {main_eom.failure + reserve_eom.failure}\n\
           \n\
           \taverage generator slowed time: {generator.slowed_mean_time_sum / generator.slowed_mean_time_quantity}')
+
+    print('\n')
+    print('Stats over 32 replications:')
+    estimates = run_replications(create_model, METRICS, 10000, replications=32, seed=2024)
+    for name, estimate in estimates.items():
+        print(f'\t{name}: {estimate}')
+
+    print('\n')
+    # replications are added until every interval is within 2% of its mean
+    estimates, stopped = run_until_precision(create_model, METRICS, 10000, relative=0.02, seed=2024, max_seconds=60)
+    print(f'Stats to 2% precision (stopped by {stopped}):')
+    for name, estimate in estimates.items():
+        print(f'\t{name}: {estimate}')
+
+    print('\n')
+    # one long run instead of replications, failures per 10000 time units as in the study above
+    batch_means = BatchMeans({
+        'main failures': lambda model: main_failures(model) * 10000,
+        'reserve failures': lambda model: reserve_failures(model) * 10000,
+    }, interval=10, rates=('main failures', 'reserve failures'))
+    model = create_model(Rand(2024), monitors=[batch_means])
+    model.simulate(1_000_000, logging=False)
+    print('Stats of one run by batch means:')
+    for name, estimate in batch_means.estimates().items():
+        print(f'\t{name}: {estimate}')
+
+    print('\n')
+    # same decision with less noise: paired replications on common and antithetic streams
+    print('Reserve failures of started_up_delay=10 minus started_up_delay=5 over 32 replications:')
+    for title, common, antithetic in (('independent streams', False, False),
+                                      ('common random numbers', True, False),
+                                      ('common random numbers, antithetic pairs', True, True)):
+        differences = run_comparison(create_model, partial(create_model, started_up_delay=10),
+                                     {'reserve failures': reserve_failures}, 10000, 32, seed=2024,
+                                     common=common, antithetic=antithetic)
+        print(f'\t{title}: {differences["reserve failures"]}')
+
+    print('\n')
+    # what-if branches forked from one warmed up system instead of simulating the warm-up again
+    model = create_model(Rand(2024))
+    model.advance(2000)
+    warmed_up = model.snapshot()
+    print('What-if branches from the state at 2000:')
+    for started_up_delay in (5, 10, 20):
+        for recovery_delay in (100, 200):
+            branch = Model.restore(warmed_up)
+            generator, reserve_eom, main_eom = branch.elements
+            reserve_eom.started_up_delay = started_up_delay
+            main_eom.recovery_delay = recovery_delay
+            branch.simulate(10000, logging=False)
+            print(f'\tstarted_up_delay={started_up_delay}, recovery_delay={recovery_delay}: '
+                  f'main failures: {main_eom.failure}, reserve failures: {reserve_eom.failure}')
@@ -0,0 +1,157 @@
+import json
+import time
+from framework import *
+
+
+class Profiler:
+    '''
+    Opt-in profiler of element handlers.
+
+    Elements are switched to profiling subclasses of their own classes (the same
+    way Model counters do it), so a model without profiler runs the original
+    methods. Wall time is recorded per element and per handler, total time
+    includes nested handlers (out_act of one element calls in_act of the next),
+    self time excludes them. With timeline every call is kept as an event of
+    Chrome trace-event format, one thread per element.
+    '''
+    HANDLERS = ('in_act', 'out_act', 'out_act_all', 'get_tnext', 'do_statistics')
+
+    _classes = {}
+
+    def __init__(self, model, handlers = HANDLERS, timeline = False, max_events = 1_000_000):
+        self.model = model
+        self.handlers = tuple(handlers)
+        self.timeline = timeline
+        self.max_events = max_events
+        self.events = []
+        self.dropped = 0
+
+        # (element id, handler) -> [calls, total time, self time]
+        self.stats = {}
+        # child time of currently running handlers
+        self.stack = []
+        self.classes = {}
+        self.start = time.perf_counter()
+        self.attach()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.detach()
+
+    def attach(self):
+        for element in self.model.elements:
+            self.classes[element.id] = element.__class__
+            element.__class__ = Profiler.profiled_class(element.__class__, self.handlers)
+            element.profiler = self
+
+    def detach(self):
+        for element in self.model.elements:
+            if element.id in self.classes:
+                element.__class__ = self.classes[element.id]
+                element.profiler = None
+        self.classes = {}
+
+    @staticmethod
+    def profiled_class(cls, handlers):
+        key = (cls, handlers)
+        if key not in Profiler._classes:
+            namespace = {'__slots__': (), 'profiled_base': cls}
+            for name in handlers:
+                if hasattr(cls, name):
+                    namespace[name] = Profiler.profiled(name, getattr(cls, name))
+            Profiler._classes[key] = type(cls.__name__, (cls,), namespace)
+        return Profiler._classes[key]
+
+    @staticmethod
+    def profiled(name, method):
+        def wrapper(self, *args, **kwargs):
+            profiler = self.profiler
+            stack = profiler.stack
+            stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                end = time.perf_counter()
+                profiler.add(self, name, start, end, stack.pop())
+        return wrapper
+
+    def add(self, element, name, start, end, children):
+        elapsed = end - start
+        if self.stack:
+            self.stack[-1] += elapsed
+
+        key = (element.id, name)
+        stat = self.stats.get(key)
+        if stat is None:
+            stat = self.stats[key] = [0, 0.0, 0.0]
+        stat[0] += 1
+        stat[1] += elapsed
+        stat[2] += elapsed - children
+
+        if self.timeline:
+            if len(self.events) < self.max_events:
+                self.events.append((element.id, name, start, elapsed, self.model.tcurr))
+            else:
+                self.dropped += 1
+
+    def report(self, top = None):
+        elements = self.model.elements
+        rows = sorted(self.stats.items(), key=lambda item: item[1][2], reverse=True)
+        if top is not None:
+            rows = rows[:top]
+
+        total_self = sum(stat[2] for stat in self.stats.values())
+        print(f'{"element":<24}{"handler":<16}{"calls":>10}{"total, s":>12}{"self, s":>12}{"self %":>8}{"us/call":>10}')
+        for (element_id, name), (calls, total, own) in rows:
+            share = own / total_self if total_self > 0 else 0.0
+            print(f'{elements[element_id].name:<24}{name:<16}{calls:>10}{total:>12.4f}{own:>12.4f}'
+                  f'{share:>8.1%}{own / calls * 1e6:>10.2f}')
+        if self.dropped:
+            print(f'{self.dropped} timeline events dropped over max_events')
+
+    def chrome_trace(self):
+        # trace-event format: complete events ('X') in microseconds, thread names as metadata
+        trace_events = [{'name': 'process_name', 'ph': 'M', 'pid': 0, 'tid': 0,
+                         'args': {'name': 'model'}}]
+        for element in self.model.elements:
+            trace_events.append({'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': element.id,
+                                 'args': {'name': element.name}})
+            trace_events.append({'name': 'thread_sort_index', 'ph': 'M', 'pid': 0, 'tid': element.id,
+                                 'args': {'sort_index': element.id}})
+
+        for element_id, name, start, elapsed, tcurr in self.events:
+            trace_events.append({
+                'name': name,
+                'cat': type(self.model.elements[element_id]).__name__,
+                'ph': 'X',
+                'pid': 0,
+                'tid': element_id,
+                'ts': (start - self.start) * 1e6,
+                'dur': elapsed * 1e6,
+                'args': {'tcurr': tcurr},
+            })
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+    def export_chrome(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.chrome_trace(), file)
+
+
+if __name__ == '__main__':
+    # python profiling.py module [trace.json], module has create_model(rand): cw here, task3 in lab3
+    import sys
+    import importlib
+    from rand import Rand
+
+    if len(sys.argv) < 2:
+        print('Usage: python profiling.py module [trace.json]')
+        sys.exit(1)
+    model = importlib.import_module(sys.argv[1]).create_model(Rand(2024))
+    with Profiler(model, timeline=True) as profiler:
+        model.simulate(1000, logging=False)
+    profiler.report()
+    if len(sys.argv) > 2:
+        profiler.export_chrome(sys.argv[2])
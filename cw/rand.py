@@ -1,39 +1,575 @@
-import random
 import math
+import operator
+import statistics
+import zlib
+import numpy as np
+
+
+BLOCK_SIZE = 4096
+
+
+class stream_method:
+    # method called on the class itself, e.g. Rand.exp(5), uses the default stream
+    def __init__(self, func):
+        self.func = func
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            instance = owner.default()
+        return self.func.__get__(instance, owner)
+
+
+class LehmerGenerator:
+    # multiplicative congruential generator z = a * z mod c (lab1.3) producing numpy blocks,
+    # implements the part of numpy Generator interface used by Rand and distributions
+    A = 5 ** 13
+    C = 2 ** 31
+    PERIOD = 2 ** 29 # for odd z
+
+    _multipliers = {}
+
+    def __init__(self, z, length = PERIOD, block_size = BLOCK_SIZE):
+        if z % 2 == 0:
+            raise ValueError('Lehmer generator state has to be odd')
+        self.z = z % LehmerGenerator.C
+        # substream is [start, start + length) of the sequence
+        self.start = self.z
+        self.length = length
+        # length before split shortened the own substream, children are cut from it
+        self.initial_length = length
+        self.position = 0
+        self.block_size = block_size
+
+        if block_size not in LehmerGenerator._multipliers:
+            multipliers = np.empty(block_size, dtype=np.uint64)
+            m = 1
+            for i in range(block_size):
+                m = m * LehmerGenerator.A % LehmerGenerator.C
+                multipliers[i] = m
+            LehmerGenerator._multipliers[block_size] = multipliers
+        self.multipliers = LehmerGenerator._multipliers[block_size]
+
+    def take(self, size):
+        # numbers past length belong to the next substream (or repeat the period of the root one)
+        if self.position + size > self.length:
+            raise ValueError(f'Lehmer substream of {self.length} numbers is exhausted '
+                             f'({self.position} used, {size} more requested), spawn fewer streams')
+        self.position += size
+
+    def jump(self, steps):
+        # skips steps numbers in O(log steps)
+        self.take(steps)
+        self.z = self.z * pow(LehmerGenerator.A, steps, LehmerGenerator.C) % LehmerGenerator.C
+
+    def split(self, n):
+        # n substreams following the own one, own substream is shortened accordingly,
+        # stride is odd since jumps by powers of two give nearly shifted copies for modulus 2^31
+        stride = self.length // (n + 1)
+        if stride % 2 == 0:
+            stride -= 1
+        if self.position > stride:
+            raise ValueError('Lehmer generator has already used more numbers than its new substream holds')
+
+        children = []
+        for i in range(1, n + 1):
+            z = self.start * pow(LehmerGenerator.A, i * stride, LehmerGenerator.C) % LehmerGenerator.C
+            children.append(LehmerGenerator(z, stride, self.block_size))
+        self.length = stride
+        return children
+
+    def next_block(self, size):
+        self.take(size)
+        out = np.empty(size, dtype=np.uint64)
+        done = 0
+        while done < size:
+            m = min(self.block_size, size - done)
+            out[done:done + m] = self.multipliers[:m] * np.uint64(self.z) % np.uint64(LehmerGenerator.C)
+            self.z = int(out[done + m - 1])
+            done += m
+        return out
+
+    def random(self, size = None):
+        if size is None:
+            self.take(1)
+            self.z = self.z * LehmerGenerator.A % LehmerGenerator.C
+            return self.z / LehmerGenerator.C
+        return self.next_block(int(np.prod(size))).reshape(size) / LehmerGenerator.C
+
+    def uniform(self, low = 0.0, high = 1.0, size = None):
+        return low + (high - low) * self.random(size)
+
+    def integers(self, low, high, size = None):
+        if size is None:
+            return low + int(self.random() * (high - low))
+        return low + (self.random(size) * (high - low)).astype(np.int64)
+
+    def normal(self, loc = 0.0, scale = 1.0, size = None):
+        # Box-Muller transform, numbers are never 0 for odd state
+        n = 1 if size is None else int(np.prod(size))
+        pairs = (n + 1) // 2
+        u = self.random(2 * pairs)
+        radius = np.sqrt(-2 * np.log(u[:pairs]))
+        angle = 2 * math.pi * u[pairs:]
+        z = np.concatenate((radius * np.cos(angle), radius * np.sin(angle)))[:n]
+        if size is None:
+            return loc + scale * float(z[0])
+        return loc + scale * z.reshape(size)
+
+    def gamma(self, shape, scale = 1.0, size = None):
+        # only integer shape (Erlang): sum of shape exponentials
+        if shape != int(shape):
+            raise ValueError('Lehmer generator supports only integer gamma shape')
+        n = 1 if size is None else int(np.prod(size))
+        x = -scale * np.log(self.random((n, int(shape)))).sum(axis=1)
+        if size is None:
+            return float(x[0])
+        return x.reshape(size)
+
+
+def erlang_survival(x, k):
+    # P(X > x) for Erlang with k phases of mean 1: sum of k first Poisson probabilities
+    x = np.maximum(np.asarray(x, dtype=float), 0)
+    term = np.exp(-x)
+    total = term.copy()
+    for n in range(1, k):
+        term = term * x / n
+        total += term
+    return total
+
+
+class AntitheticGenerator:
+    # mirror of a generator: uniform u becomes 1 - u, normal z becomes -z, integer i becomes
+    # low + high - 1 - i and Erlang x becomes F^-1(1 - F(x)), so a stream and its mirror
+    # started from the same state give negatively correlated variates with the same distribution
+    def __init__(self, generator):
+        self.generator = generator
+
+    def random(self, size = None):
+        return 1.0 - self.generator.random(size)
+
+    def uniform(self, low = 0.0, high = 1.0, size = None):
+        return low + high - self.generator.uniform(low, high, size)
+
+    def integers(self, low, high, size = None):
+        return low + high - 1 - self.generator.integers(low, high, size)
+
+    def normal(self, loc = 0.0, scale = 1.0, size = None):
+        return 2 * loc - self.generator.normal(loc, scale, size)
+
+    def gamma(self, shape, scale = 1.0, size = None):
+        if shape != int(shape):
+            raise ValueError('Antithetic generator supports only integer gamma shape')
+        k = int(shape)
+        x = np.asarray(self.generator.gamma(k, 1.0, size), dtype=float)
+        # x' with survival(x') = cdf(x), found by bisection
+        target = 1 - erlang_survival(x, k)
+        low = np.zeros_like(x)
+        high = np.full_like(x, k + 40 * math.sqrt(k) + 40)
+        for _ in range(60):
+            middle = (low + high) / 2
+            above = erlang_survival(middle, k) > target
+            low = np.where(above, middle, low)
+            high = np.where(above, high, middle)
+        mirrored = scale * (low + high) / 2
+        return float(mirrored) if size is None else mirrored
+
 
 class Rand:
-    def exp(mean_time):
+    # random stream, independent child streams are spawned from one root seed,
+    # backend is 'pcg64' (numpy default) or 'lehmer' (LehmerGenerator substreams),
+    # antithetic stream gives mirrored variates of the stream with the same seed
+    _default = None
+
+    # first word of spawn keys of named streams, spawn() numbers children from 0
+    STREAM_KEY = 2 ** 32 - 1
+
+    def __init__(self, seed = None, backend = 'pcg64', antithetic = False):
+        self.backend = backend
+        self.antithetic = antithetic
+        if backend == 'lehmer':
+            if isinstance(seed, LehmerGenerator):
+                self.generator = seed
+            elif seed is None:
+                state = int(np.random.SeedSequence().generate_state(1)[0])
+                self.generator = LehmerGenerator(state % LehmerGenerator.C | 1)
+            else:
+                self.generator = LehmerGenerator(seed % LehmerGenerator.C | 1)
+        elif backend == 'pcg64':
+            if isinstance(seed, np.random.SeedSequence):
+                self.seed_sequence = seed
+            else:
+                self.seed_sequence = np.random.SeedSequence(seed)
+            self.generator = np.random.default_rng(self.seed_sequence)
+        else:
+            raise ValueError(f'Unknown backend: {backend}, expected pcg64 or lehmer')
+        if antithetic:
+            self.generator = AntitheticGenerator(self.generator)
+
+    @classmethod
+    def default(cls):
+        if cls._default is None:
+            cls._default = cls()
+        return cls._default
+
+    @classmethod
+    def set_default(cls, rand):
+        cls._default = rand
+
+    def get_state(self):
+        # position of the stream, set_state returns it there
+        generator = self.generator.generator if self.antithetic else self.generator
+        if self.backend == 'lehmer':
+            return generator.z, generator.position
+        return generator.bit_generator.state
+
+    def set_state(self, state):
+        generator = self.generator.generator if self.antithetic else self.generator
+        if self.backend == 'lehmer':
+            generator.z, generator.position = state
+        else:
+            generator.bit_generator.state = state
+
+    def spawn(self, n):
+        if self.backend == 'lehmer':
+            generator = self.generator.generator if self.antithetic else self.generator
+            return [Rand(child, 'lehmer', self.antithetic) for child in generator.split(n)]
+        return [Rand(child, antithetic=self.antithetic) for child in self.seed_sequence.spawn(n)]
+
+    def stream(self, *key):
+        '''
+        Child stream named by key, e.g. rand.stream('Main EOM', 'failures').
+        Unlike spawn it does not depend on the order or the amount of streams
+        taken before, so models of two configurations built from the same seed
+        get the same variates for every element and purpose (common random numbers)
+        even if they have different elements or take streams in different order.
+        '''
+        if self.backend != 'pcg64':
+            raise ValueError('Named streams are supported only by pcg64 backend')
+        words = tuple(zlib.crc32(str(part).encode()) for part in key)
+        seed_sequence = np.random.SeedSequence(self.seed_sequence.entropy,
+                                               spawn_key=self.seed_sequence.spawn_key + (Rand.STREAM_KEY,) + words)
+        return Rand(seed_sequence, antithetic=self.antithetic)
+
+    def replay(self, antithetic = False):
+        # new stream repeating this one from its start, mirrored if antithetic
+        if self.backend == 'lehmer':
+            generator = self.generator.generator if self.antithetic else self.generator
+            start = LehmerGenerator(generator.start, generator.initial_length, generator.block_size)
+            return Rand(start, 'lehmer', self.antithetic != antithetic)
+        # own seed sequence counts spawned children, a fresh one spawns them again
+        seed_sequence = np.random.SeedSequence(self.seed_sequence.entropy, spawn_key=self.seed_sequence.spawn_key,
+                                               pool_size=self.seed_sequence.pool_size)
+        return Rand(seed_sequence, antithetic=self.antithetic != antithetic)
+
+    @stream_method
+    def exp(self, mean_time):
         a = 0
         while a == 0:
-            a = random.random()
+            a = self.generator.random()
         a = -mean_time * math.log(a)
         return a
-        
-    def norm(mean_time, std_deviation):
-        a = random.normalvariate(mean_time, std_deviation)
+
+    @stream_method
+    def norm(self, mean_time, std_deviation):
+        a = self.generator.normal(mean_time, std_deviation)
         return a
-    
-    def uniform(a, b):
-        a = random.uniform(a, b)
+
+    @stream_method
+    def uniform(self, a, b):
+        a = self.generator.uniform(a, b)
         return a
 
-    def erlang(mean_time, k):
-        return random.gammavariate(k, mean_time / k)
+    @stream_method
+    def erlang(self, mean_time, k):
+        return self.generator.gamma(k, mean_time / k)
+
+    @stream_method
+    def integer(self, a, b):
+        return int(self.generator.integers(a, b + 1))
+
+
+class Distribution:
+    # pre-generates variates in numpy blocks of block_size and hands them out one at a time,
+    # instance is called as a delay function, e.g. Process delay_func
+    discrete = False
+    def __init__(self, rand = None, block_size = BLOCK_SIZE):
+        self.rand = rand if rand is not None else Rand.default()
+        self.block_size = block_size
+        self.values = iter(())
+        # state of the stream before the current block, the block is generated again on unpickling
+        self.block_state = None
+
+    def __call__(self):
+        try:
+            return next(self.values)
+        except StopIteration:
+            self.block_state = self.rand.get_state()
+            self.values = iter(self.sample(self.block_size).tolist())
+            return next(self.values)
+
+    def __getstate__(self):
+        # amount of values left in the block instead of the block itself
+        state = dict(self.__dict__)
+        state['values'] = operator.length_hint(self.values)
+        return state
+
+    def __setstate__(self, state):
+        state = dict(state)
+        left = state.pop('values')
+        self.__dict__.update(state)
+        self.values = iter(())
+        if left > 0:
+            current = self.rand.get_state()
+            self.rand.set_state(self.block_state)
+            block = self.sample(self.block_size).tolist()
+            self.rand.set_state(current)
+            self.values = iter(block[len(block) - left:])
+
+    def sample(self, size):
+        raise NotImplementedError()
+
+    # theoretical characteristics, used to validate generators
+    def mean(self):
+        raise NotImplementedError()
+
+    def variance(self):
+        raise NotImplementedError()
+
+    def cdf(self, x):
+        raise NotImplementedError()
+
+    def support(self):
+        # discrete distributions: list of distinct values and array of their probabilities
+        raise NotImplementedError()
+
+    def ppf(self, p):
+        # inverse of cdf found by bisection, works on numpy arrays
+        p = np.asarray(p, dtype=float)
+        width = 40 * math.sqrt(self.variance())
+        low = np.full(p.shape, self.mean() - width)
+        high = np.full(p.shape, self.mean() + width)
+        for _ in range(100):
+            middle = (low + high) / 2
+            below = self.cdf(middle) < p
+            low = np.where(below, middle, low)
+            high = np.where(below, high, middle)
+        return (low + high) / 2
+
+
+class Exponential(Distribution):
+    def __init__(self, mean_time, rand = None, block_size = BLOCK_SIZE):
+        super().__init__(rand, block_size)
+        self.mean_time = mean_time
+
+    def sample(self, size):
+        # same as Rand.exp, zeros are drawn again
+        a = self.rand.generator.random(size)
+        zeros = a == 0
+        while zeros.any():
+            a[zeros] = self.rand.generator.random(np.count_nonzero(zeros))
+            zeros = a == 0
+        return -self.mean_time * np.log(a)
+
+    def mean(self):
+        return self.mean_time
+
+    def variance(self):
+        return self.mean_time ** 2
+
+    def cdf(self, x):
+        return 1 - np.exp(-np.maximum(x, 0) / self.mean_time)
+
+    def ppf(self, p):
+        return -self.mean_time * np.log1p(-np.asarray(p, dtype=float))
+
+
+class Normal(Distribution):
+    def __init__(self, mean_time, std_deviation, rand = None, block_size = BLOCK_SIZE):
+        super().__init__(rand, block_size)
+        self.mean_time = mean_time
+        self.std_deviation = std_deviation
+
+    def sample(self, size):
+        return self.rand.generator.normal(self.mean_time, self.std_deviation, size)
+
+    def mean(self):
+        return self.mean_time
+
+    def variance(self):
+        return self.std_deviation ** 2
+
+    def cdf(self, x):
+        return np.vectorize(statistics.NormalDist(self.mean_time, self.std_deviation).cdf, otypes=[float])(x)
+
+    def ppf(self, p):
+        return np.vectorize(statistics.NormalDist(self.mean_time, self.std_deviation).inv_cdf, otypes=[float])(p)
+
+
+class Uniform(Distribution):
+    def __init__(self, a, b, rand = None, block_size = BLOCK_SIZE):
+        super().__init__(rand, block_size)
+        self.a = a
+        self.b = b
+
+    def sample(self, size):
+        return self.rand.generator.uniform(self.a, self.b, size)
+
+    def mean(self):
+        return (self.a + self.b) / 2
+
+    def variance(self):
+        return (self.b - self.a) ** 2 / 12
+
+    def cdf(self, x):
+        return np.clip((np.asarray(x, dtype=float) - self.a) / (self.b - self.a), 0, 1)
+
+    def ppf(self, p):
+        return self.a + (self.b - self.a) * np.asarray(p, dtype=float)
+
+
+class Erlang(Distribution):
+    def __init__(self, mean_time, k, rand = None, block_size = BLOCK_SIZE):
+        super().__init__(rand, block_size)
+        self.mean_time = mean_time
+        self.k = k
+
+    def sample(self, size):
+        return self.rand.generator.gamma(self.k, self.mean_time / self.k, size)
+
+    def mean(self):
+        return self.mean_time
+
+    def variance(self):
+        return self.mean_time ** 2 / self.k
+
+    def cdf(self, x):
+        return 1 - erlang_survival(np.asarray(x, dtype=float) * self.k / self.mean_time, self.k)
+
+
+class IntegerUniform(Distribution):
+    discrete = True
+
+    def __init__(self, a, b, rand = None, block_size = BLOCK_SIZE):
+        super().__init__(rand, block_size)
+        self.a = a
+        self.b = b
+
+    def sample(self, size):
+        return self.rand.generator.integers(self.a, self.b + 1, size)
+
+    def mean(self):
+        return (self.a + self.b) / 2
+
+    def variance(self):
+        return ((self.b - self.a + 1) ** 2 - 1) / 12
+
+    def cdf(self, x):
+        return np.clip((np.floor(np.asarray(x, dtype=float)) - self.a + 1) / (self.b - self.a + 1), 0, 1)
+
+    def support(self):
+        n = self.b - self.a + 1
+        return list(range(self.a, self.b + 1)), np.full(n, 1 / n)
+
+
+class Discrete(Distribution):
+    # values with given probabilities, Walker alias tables are built once,
+    # every draw is one table lookup
+    discrete = True
+
+    def __init__(self, values, probabilities, rand = None, block_size = BLOCK_SIZE):
+        super().__init__(rand, block_size)
+        probabilities = np.asarray(probabilities, dtype=float)
+        if len(values) != len(probabilities) or len(values) == 0:
+            raise ValueError('Discrete needs the same non-zero amount of values and probabilities')
+        if (probabilities < 0).any() or not math.isclose(probabilities.sum(), 1.0, abs_tol=1e-9):
+            raise ValueError('Probabilities have to be non-negative and sum to 1')
+
+        self.outcomes = np.empty(len(values), dtype=object)
+        self.outcomes[:] = values
+        self.probabilities = probabilities
+        self.prob, self.alias = Discrete.build_alias(probabilities)
+
+    @staticmethod
+    def build_alias(probabilities):
+        # Vose's construction
+        n = len(probabilities)
+        scaled = probabilities * n
+        prob = np.ones(n)
+        alias = np.arange(n)
+        small = [i for i in range(n) if scaled[i] < 1.0]
+        large = [i for i in range(n) if scaled[i] >= 1.0]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            prob[less] = scaled[less]
+            alias[less] = more
+            scaled[more] += scaled[less] - 1.0
+            if scaled[more] < 1.0:
+                small.append(more)
+            else:
+                large.append(more)
+        return prob, alias
+
+    def sample(self, size):
+        column = self.rand.generator.integers(0, len(self.prob), size)
+        coin = self.rand.generator.random(size)
+        return self.outcomes[np.where(coin < self.prob[column], column, self.alias[column])]
+
+    def support(self):
+        # repeated values are merged
+        probabilities = {}
+        for value, probability in zip(self.outcomes, self.probabilities):
+            probabilities[value] = probabilities.get(value, 0.0) + probability
+        return list(probabilities), np.array(list(probabilities.values()))
+
+    def numeric_support(self):
+        values, probabilities = self.support()
+        try:
+            return np.asarray(values, dtype=float), probabilities
+        except (TypeError, ValueError):
+            raise TypeError('Moments and cdf of Discrete need numeric values') from None
+
+    def mean(self):
+        values, probabilities = self.numeric_support()
+        return float((values * probabilities).sum())
+
+    def variance(self):
+        values, probabilities = self.numeric_support()
+        return float((values ** 2 * probabilities).sum() - self.mean() ** 2)
+
+    def cdf(self, x):
+        values, probabilities = self.numeric_support()
+        order = np.argsort(values)
+        cumulative = np.concatenate(([0.0], np.cumsum(probabilities[order])))
+        return cumulative[np.searchsorted(values[order], np.asarray(x, dtype=float), side='right')]
 
-    class Integer:
-        def uniform(a, b):
-            a = random.randint(a, b)
-            return a
 
 if __name__ == '__main__':
     # Test exp function
     print(Rand.exp(5)) # Expected output: a float value
-    
+
     # Test norm function
     print(Rand.norm(0, 1)) # Expected output: a float value
-    
+
     # Test uniform function
     print(Rand.uniform(0, 10)) # Expected output: a float value
-    
+
     # Test erlang function
     print(Rand.erlang(5, 3)) # Expected output: a float value
+
+    # Test independent streams
+    first, second = Rand(12345).spawn(2)
+    print(first.exp(5), second.exp(5)) # Expected output: two different float values
+
+    # Test block distribution
+    exp = Exponential(5, Rand(12345), block_size=16)
+    print(sum(exp() for _ in range(100000)) / 100000) # Expected output: about 5
+
+    # Test Lehmer backend
+    lehmer = Exponential(5, Rand(12345, 'lehmer'))
+    print(sum(lehmer() for _ in range(100000)) / 100000) # Expected output: about 5
+
+    # Test discrete distribution
+    discrete = Discrete(['a', 'b', 'c'], [0.5, 0.1, 0.4], Rand(12345))
+    draws = [discrete() for _ in range(100000)]
+    print([draws.count(value) / 100000 for value in 'abc']) # Expected output: about [0.5, 0.1, 0.4]
@@ -0,0 +1,431 @@
+import math
+import os
+import statistics
+import time
+import multiprocessing
+from rand import Rand
+from framework import Monitor
+
+
+def student_t_quantile(p, df):
+    # quantile of Student's t distribution,
+    # exact for df 1 and 2, Cornish-Fisher expansion (Abramowitz & Stegun 26.7.5) otherwise
+    if df == 1:
+        return math.tan(math.pi * (p - 0.5))
+    if df == 2:
+        return (2 * p - 1) / math.sqrt(2 * p * (1 - p))
+
+    z = statistics.NormalDist().inv_cdf(p)
+    g1 = (z ** 3 + z) / 4
+    g2 = (5 * z ** 5 + 16 * z ** 3 + 3 * z) / 96
+    g3 = (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / 384
+    g4 = (79 * z ** 9 + 776 * z ** 7 + 1482 * z ** 5 - 1920 * z ** 3 - 945 * z) / 92160
+    return z + g1 / df + g2 / df ** 2 + g3 / df ** 3 + g4 / df ** 4
+
+
+class Estimate:
+    # mean of independent observations with confidence interval half width
+    def __init__(self, values, confidence = 0.95):
+        self.values = list(values)
+        self.confidence = confidence
+        self.count = len(self.values)
+        self.mean = statistics.fmean(self.values) if self.count > 0 else float('nan')
+
+        if self.count > 1:
+            self.std = statistics.stdev(self.values)
+            t = student_t_quantile((1 + confidence) / 2, self.count - 1)
+            self.half_width = t * self.std / math.sqrt(self.count)
+        else:
+            self.std = float('nan')
+            self.half_width = float('inf')
+
+    def interval(self):
+        return self.mean - self.half_width, self.mean + self.half_width
+
+    def __repr__(self):
+        return f'{self.mean:.4f} ± {self.half_width:.4f} ({self.confidence:.0%}, n={self.count})'
+
+
+# worker state, set once per worker process by the pool initializer
+_model_factories = None
+_metrics = None
+_time_modeling = None
+
+
+def _init_worker(model_factories, metrics, time_modeling):
+    global _model_factories, _metrics, _time_modeling
+    _model_factories = model_factories
+    _metrics = metrics
+    _time_modeling = time_modeling
+
+
+def handled_events(model):
+    # events handled since the last reset of statistics: arrivals of creates and completions of processes,
+    # model.iterations counts distinct event times only
+    return sum(element.quantity for element in model.elements)
+
+
+def _run_replication(task):
+    # task is (index, configuration, rand), configuration is an index of the model factory
+    index, configuration, rand = task
+    # class level calls like Rand.exp(5) use the replication stream as well,
+    # the default stream of the caller is given back when replications run in its process
+    previous = Rand._default
+    Rand.set_default(rand)
+    try:
+        # the model is built for every replication: restoring a snapshot built once per worker costs
+        # as much as the factory (about 0.3 ms for cw.py), and it would keep variates drawn while
+        # building (MainEOM draws its first shutdown) from the stream of the snapshot instead of rand
+        model = _model_factories[configuration](rand)
+        model.simulate(_time_modeling, logging=False)
+        return index, {name: metric(model) for name, metric in _metrics.items()}, handled_events(model)
+    finally:
+        Rand.set_default(previous)
+
+
+def _run_tasks(model_factories, metrics, time_modeling, tasks, processes):
+    # values of metrics of every task in order of task indices
+    if processes is None:
+        processes = os.cpu_count()
+    results = [None] * len(tasks)
+
+    if processes == 1:
+        _init_worker(model_factories, metrics, time_modeling)
+        for task in tasks:
+            index, values, _ = _run_replication(task)
+            results[index] = values
+    else:
+        with multiprocessing.Pool(processes, _init_worker, (model_factories, metrics, time_modeling)) as pool:
+            for index, values, _ in pool.imap_unordered(_run_replication, tasks):
+                results[index] = values
+    return results
+
+
+def _pairs(streams, antithetic):
+    # streams of one replication: the stream itself, and its mirror for an antithetic pair
+    if antithetic:
+        return [[rand, rand.replay(antithetic=True)] for rand in streams]
+    return [[rand] for rand in streams]
+
+
+def _tasks(configuration, groups, start = 0):
+    return [(start + i, configuration, rand) for i, rand in enumerate(rand for group in groups for rand in group)]
+
+
+def _observations(results, metrics, size):
+    # one observation per replication, mean over its antithetic pair
+    return {name: [statistics.fmean(values[name] for values in results[i:i + size])
+                   for i in range(0, len(results), size)] for name in metrics}
+
+
+def run_replications(model_factory, metrics, time_modeling, replications, seed = None,
+                     processes = None, confidence = 0.95, antithetic = False):
+    '''
+    Runs independent replications of a model across a pool of worker processes.
+
+    model_factory(rand) has to return a new Model using rand stream (or streams
+    spawned from it), metrics maps metric name to a function taking simulated
+    model and returning a number. Every replication gets an independent stream
+    spawned from seed. Workers are reused for all replications, factory and
+    metrics are sent to every worker once. With antithetic every replication is
+    a pair of runs on a stream and its mirror, the observation is their mean.
+    Returns dict of metric name to Estimate.
+    '''
+    groups = _pairs(Rand(seed).spawn(replications), antithetic)
+    results = _run_tasks([model_factory], metrics, time_modeling, _tasks(0, groups), processes)
+
+    observations = _observations(results, metrics, len(groups[0]))
+    return {name: Estimate(observations[name], confidence) for name in metrics}
+
+
+def run_comparison(baseline_factory, alternative_factory, metrics, time_modeling, replications, seed = None,
+                   processes = None, confidence = 0.95, common = True, antithetic = False):
+    '''
+    Compares two configurations of a model by paired replications, returns dict
+    of metric name to Estimate of the difference alternative - baseline.
+
+    With common random numbers replication i of both configurations is driven
+    by the same stream, so the difference is not blurred by independent noise.
+    It works best when factories take streams by name (Rand.stream) per element
+    and purpose, then a changed element does not shift variates of the others.
+    antithetic makes every replication a pair of runs on a stream and its mirror.
+    '''
+    count = 2 if antithetic else 1
+    streams = Rand(seed).spawn(replications if common else 2 * replications)
+    baseline = _pairs(streams[:replications], antithetic)
+    if common:
+        alternative = [[rand.replay() for rand in group] for group in baseline]
+    else:
+        alternative = _pairs(streams[replications:], antithetic)
+
+    tasks = _tasks(0, baseline) + _tasks(1, alternative, replications * count)
+    results = _run_tasks([baseline_factory, alternative_factory], metrics, time_modeling, tasks, processes)
+
+    baseline_observations = _observations(results[:replications * count], metrics, count)
+    alternative_observations = _observations(results[replications * count:], metrics, count)
+    return {name: Estimate([b - a for a, b in zip(baseline_observations[name], alternative_observations[name])],
+                           confidence) for name in metrics}
+
+
+def _target(target, name):
+    # target is one number for all metrics or dict of metric name to number
+    if isinstance(target, dict):
+        return target.get(name)
+    return target
+
+
+def precision_reached(estimate, relative = None, absolute = None):
+    # half width is within absolute, or within relative part of the mean
+    if absolute is not None and estimate.half_width <= absolute:
+        return True
+    if relative is not None and estimate.half_width <= relative * abs(estimate.mean):
+        return True
+    return False
+
+
+def _needed(estimates, relative, absolute):
+    # metrics which have not reached precision yet -> ratio of half width to its target
+    ratios = {}
+    for name, estimate in estimates.items():
+        metric_relative, metric_absolute = _target(relative, name), _target(absolute, name)
+        if precision_reached(estimate, metric_relative, metric_absolute):
+            continue
+        targets = [target for target in (metric_absolute,
+                                         None if metric_relative is None else metric_relative * abs(estimate.mean))
+                   if target is not None and target > 0]
+        ratios[name] = estimate.half_width / max(targets) if targets else float('inf')
+    return ratios
+
+
+def run_until_precision(model_factory, metrics, time_modeling, relative = None, absolute = None,
+                        confidence = 0.95, seed = None, processes = None, min_replications = 5,
+                        max_replications = 1000, max_seconds = None, max_events = None, logging = False):
+    '''
+    Sequential procedure over independent replications: runs min_replications,
+    then adds replications until the confidence interval of every metric reaches
+    its precision, relative (half width <= relative * |mean|) or absolute
+    (half width <= absolute), each one a number or dict of metric name to number.
+
+    Size of the next stage comes from half width shrinking as 1 / sqrt(n), it is
+    at most the number of replications done, so a budget (max_replications,
+    max_seconds of wall time, max_events handled over all replications) is overrun by
+    one stage at most. Streams are spawned from seed in order, so replication i
+    is the same one as in run_replications with the same seed. Returns dict of
+    metric name to Estimate and the reason of the stop: 'precision',
+    'replications', 'time' or 'events'.
+    '''
+    if relative is None and absolute is None:
+        raise ValueError('Either relative or absolute precision has to be set')
+    if processes is None:
+        processes = os.cpu_count()
+
+    root = Rand(seed)
+    results = []
+    events = 0
+    start = time.perf_counter()
+
+    pool = None
+    if processes == 1:
+        _init_worker([model_factory], metrics, time_modeling)
+    else:
+        pool = multiprocessing.Pool(processes, _init_worker, ([model_factory], metrics, time_modeling))
+
+    try:
+        stage = min(max(min_replications, 2), max_replications)
+        while True:
+            tasks = _tasks(0, _pairs(root.spawn(stage), False), len(results))
+            if pool is None:
+                replies = [_run_replication(task) for task in tasks]
+            else:
+                replies = list(pool.imap(_run_replication, tasks))
+            for _, values, handled in replies:
+                results.append(values)
+                events += handled
+
+            estimates = {name: Estimate([values[name] for values in results], confidence) for name in metrics}
+            ratios = _needed(estimates, relative, absolute)
+            count = len(results)
+            if logging:
+                print(f'{count} replications, {events} events, {time.perf_counter() - start:.2f} s, '
+                      f'not precise: {", ".join(ratios) if ratios else "none"}')
+
+            if not ratios:
+                return estimates, 'precision'
+            if count >= max_replications:
+                return estimates, 'replications'
+            if max_seconds is not None and time.perf_counter() - start >= max_seconds:
+                return estimates, 'time'
+            if max_events is not None and events >= max_events:
+                return estimates, 'events'
+
+            ratio = max(ratios.values())
+            needed = math.ceil(count * ratio ** 2) - count if math.isfinite(ratio) else count
+            stage = min(max(needed, 1), count, max_replications - count)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def simulate_until_precision(model, metrics, batch_time, relative = None, absolute = None,
+                             confidence = 0.95, warmup = 0.0, min_batches = 10, max_batches = 10000,
+                             max_seconds = None, max_events = None, logging = False):
+    '''
+    Sequential procedure over batches of one long run of model: after warmup the
+    run is advanced by batch_time at a time, metrics are taken at the end of every
+    batch and statistics are reset (Model.reset_statistics), so a metric has to
+    read statistics collected since the reset, like failure or get_mean_queue().
+    Batch means are treated as independent observations, so batch_time has to be
+    long compared to correlation time of the model. Stops at the same precision
+    targets as run_until_precision, or after max_batches, max_seconds of wall time
+    or max_events handled. Returns dict of metric name to Estimate and the reason of the stop.
+    '''
+    if relative is None and absolute is None:
+        raise ValueError('Either relative or absolute precision has to be set')
+
+    start = time.perf_counter()
+    events = 0
+    if warmup > 0:
+        model.advance(model.tcurr + warmup)
+    events += handled_events(model)
+    model.reset_statistics()
+
+    results = []
+    while True:
+        model.advance(model.tcurr + batch_time)
+        results.append({name: metric(model) for name, metric in metrics.items()})
+        events += handled_events(model)
+        model.reset_statistics()
+
+        count = len(results)
+        if count < min(min_batches, max_batches):
+            continue
+        estimates = {name: Estimate([values[name] for values in results], confidence) for name in metrics}
+        ratios = _needed(estimates, relative, absolute)
+        if logging and (not ratios or count % min_batches == 0):
+            print(f'{count} batches, tcurr: {model.tcurr:.2f}, {time.perf_counter() - start:.2f} s, '
+                  f'not precise: {", ".join(ratios) if ratios else "none"}')
+
+        if not ratios:
+            return estimates, 'precision'
+        if count >= max_batches:
+            return estimates, 'batches'
+        if max_seconds is not None and time.perf_counter() - start >= max_seconds:
+            return estimates, 'time'
+        if max_events is not None and events >= max_events:
+            return estimates, 'events'
+
+
+def lag1_correlation(values):
+    # lag 1 autocorrelation of a series, 0 for series too short or constant
+    n = len(values)
+    if n < 3:
+        return 0.0
+    mean = statistics.fmean(values)
+    deviations = [value - mean for value in values]
+    variance = sum(deviation * deviation for deviation in deviations)
+    if variance == 0:
+        return 0.0
+    return sum(deviations[i] * deviations[i + 1] for i in range(n - 1)) / variance
+
+
+class BatchEstimate(Estimate):
+    # estimate over batch means of one run, batch_time is the model time of a batch
+    def __init__(self, values, batch_time, confidence = 0.95):
+        super().__init__(values, confidence)
+        self.batch_time = batch_time
+        self.correlation = lag1_correlation(self.values)
+
+    def __repr__(self):
+        return f'{super().__repr__()[:-1]}, batch={self.batch_time:g}, lag1={self.correlation:+.2f})'
+
+
+class BatchMeans(Monitor):
+    '''
+    Online batch means over one long run, attached to a model as a monitor
+    (Model(..., monitors=[batch_means])).
+
+    Every interval of model time each metric(model) gives an observation: the
+    value itself, or for metrics named in rates the growth of a cumulative
+    value per time unit (failure count gives failure rate, queue_integral()
+    gives mean queue). Observations are summed into batches of batch size
+    intervals; when max_batches batch means are kept, neighbour batches are
+    merged and batch size doubles, so memory per metric is bounded whatever
+    the run length. Estimate of a metric merges batches further while lag 1
+    autocorrelation of batch means is over max_correlation and at least
+    2 * min_batches are left, then batch means are taken as independent.
+    Statistics reset by the model (end of warm-up) starts the batches again.
+    '''
+
+    def __init__(self, metrics, interval, rates = (), max_batches = 64, min_batches = 10,
+                 max_correlation = 0.1, confidence = 0.95):
+        super().__init__('BatchMeans', interval)
+        if max_batches % 2 != 0 or max_batches < 2 * min_batches:
+            raise ValueError('max_batches has to be even and at least 2 * min_batches')
+        self.metrics = metrics
+        self.interval = interval
+        self.rates = set(rates)
+        self.max_batches = max_batches
+        self.min_batches = min_batches
+        self.max_correlation = max_correlation
+        self.confidence = confidence
+        # model tstat the batches are collected since
+        self.since = None
+        self.restart()
+
+    def restart(self):
+        self.batch = 1
+        self.count = 0
+        self.sums = {name: 0.0 for name in self.metrics}
+        self.last = {name: None for name in self.rates}
+        self.batches = {name: [] for name in self.metrics}
+
+    def observe(self, name, metric):
+        value = metric(self.model)
+        if name not in self.rates:
+            return value
+        last, self.last[name] = self.last[name], value
+        return None if last is None else (value - last) / self.interval
+
+    def out_act(self):
+        self.tnext = self.tcurr + self.interval
+        if self.model.tstat != self.since:
+            self.since = self.model.tstat
+            self.restart()
+
+        observations = {name: self.observe(name, metric) for name, metric in self.metrics.items()}
+        # rates need a previous value, the first observation after a restart only sets it
+        if any(value is None for value in observations.values()):
+            return
+
+        for name, value in observations.items():
+            self.sums[name] += value
+        self.count += 1
+        if self.count < self.batch:
+            return
+
+        for name in self.metrics:
+            self.batches[name].append(self.sums[name] / self.batch)
+            self.sums[name] = 0.0
+        self.count = 0
+
+        if len(self.batches[next(iter(self.metrics))]) >= self.max_batches:
+            for name, batches in self.batches.items():
+                self.batches[name] = BatchMeans.merge(batches)
+            self.batch *= 2
+
+    @staticmethod
+    def merge(batches):
+        # means of neighbour pairs, an odd last batch is dropped
+        return [(batches[i] + batches[i + 1]) / 2 for i in range(0, len(batches) - 1, 2)]
+
+    def estimate(self, name):
+        batches = self.batches[name]
+        batch = self.batch
+        while len(batches) >= 2 * self.min_batches and abs(lag1_correlation(batches)) > self.max_correlation:
+            batches = BatchMeans.merge(batches)
+            batch *= 2
+        return BatchEstimate(batches, batch * self.interval, self.confidence)
+
+    def estimates(self):
+        return {name: self.estimate(name) for name in self.metrics}
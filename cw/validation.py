@@ -0,0 +1,206 @@
+import math
+import time
+import numpy as np
+from rand import *
+
+
+def chi2_sf(x, df):
+    # upper tail of chi-square distribution, regularized incomplete gamma Q(df/2, x/2)
+    a, x = df / 2, x / 2
+    if x <= 0:
+        return 1.0
+    log_prefix = a * math.log(x) - x - math.lgamma(a)
+    if x < a + 1:
+        # series for the lower part
+        term = total = 1 / a
+        n = a
+        while abs(term) > abs(total) * 1e-15:
+            n += 1
+            term *= x / n
+            total += term
+        return max(0.0, 1 - total * math.exp(log_prefix))
+
+    # continued fraction (modified Lentz) for the upper part
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    h = d
+    i = 0
+    while True:
+        i += 1
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return math.exp(log_prefix) * h
+
+
+def kolmogorov_sf(d, n):
+    # asymptotic p-value of Kolmogorov-Smirnov statistic with Stephens correction
+    sqrt_n = math.sqrt(n)
+    l = (sqrt_n + 0.12 + 0.11 / sqrt_n) * d
+    if l < 0.2:
+        return 1.0
+    total = 0.0
+    for j in range(1, 101):
+        term = 2 * (-1) ** (j - 1) * math.exp(-2 * j * j * l * l)
+        total += term
+        if abs(term) < 1e-12:
+            break
+    return min(1.0, max(0.0, total))
+
+
+class ValidationReport:
+    # mean and variance are None for discrete values which are not numbers,
+    # ks is None for discrete distributions
+    def __init__(self, distribution, count, mean, variance, chi2, chi2_df, ks, seconds):
+        self.distribution = distribution
+        self.count = count
+        self.mean = mean
+        self.variance = variance
+        self.chi2 = chi2
+        self.chi2_df = chi2_df
+        self.chi2_p = chi2_sf(chi2, chi2_df)
+        self.ks = ks
+        self.ks_p = kolmogorov_sf(ks, count) if ks is not None else None
+        self.seconds = seconds
+
+    def print_report(self):
+        distribution = self.distribution
+        print(f'{type(distribution).__name__}: {self.count} samples in {self.seconds:.2f} s')
+        if self.mean is not None:
+            mean_error = math.sqrt(distribution.variance() / self.count)
+            print(f'\tmean: {self.mean:.6f}, theoretical: {distribution.mean():.6f}, standard error: {mean_error:.2e}')
+            print(f'\tvariance: {self.variance:.6f}, theoretical: {distribution.variance():.6f}')
+        print(f'\tchi2: {self.chi2:.2f}, df: {self.chi2_df}, p-value: {self.chi2_p:.4f}')
+        if self.ks is not None:
+            print(f'\tKS: {self.ks:.2e}, p-value: {self.ks_p:.4f}')
+
+
+class Moments:
+    # running mean and sum of squared deviations merged chunk by chunk (Chan et al.)
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, chunk):
+        size = len(chunk)
+        chunk_mean = chunk.mean()
+        chunk_m2 = ((chunk - chunk_mean) ** 2).sum()
+        delta = chunk_mean - self.mean
+        total = self.count + size
+        self.mean += delta * size / total
+        self.m2 += chunk_m2 + delta ** 2 * self.count * size / total
+        self.count = total
+
+    def variance(self):
+        return self.m2 / (self.count - 1)
+
+
+def validate(distribution, samples, chunk_size = 1_000_000, bins = 64, ks_cells = 65536):
+    '''
+    Streams samples variates of distribution in chunks and compares them with its
+    theoretical cdf. Memory does not depend on samples.
+
+    Cells are equiprobable under the theoretical distribution. KS statistic is
+    evaluated on the edges of ks_cells cells, so it is accurate up to 1/ks_cells.
+    Chi-square uses bins groups of these cells, ks_cells has to be divisible by bins.
+    '''
+    if distribution.discrete:
+        return validate_discrete(distribution, samples, chunk_size)
+    if ks_cells % bins != 0:
+        raise ValueError('ks_cells has to be divisible by bins')
+
+    edges = distribution.ppf(np.arange(1, ks_cells) / ks_cells)
+    counts = np.zeros(ks_cells, dtype=np.int64)
+    moments = Moments()
+
+    start = time.perf_counter()
+    while moments.count < samples:
+        chunk = distribution.sample(min(chunk_size, samples - moments.count))
+        counts += np.bincount(np.searchsorted(edges, chunk, side='right'), minlength=ks_cells)
+        moments.add(chunk)
+    seconds = time.perf_counter() - start
+    count = moments.count
+
+    observed = counts.reshape(bins, -1).sum(axis=1)
+    expected = count / bins
+    chi2 = float(((observed - expected) ** 2 / expected).sum())
+
+    empirical = np.cumsum(counts)[:-1] / count
+    ks = float(np.abs(empirical - np.arange(1, ks_cells) / ks_cells).max())
+
+    return ValidationReport(distribution, count, moments.mean, moments.variance(), chi2, bins - 1, ks, seconds)
+
+
+def validate_discrete(distribution, samples, chunk_size = 1_000_000, min_expected = 5):
+    '''
+    Chi-square test of a discrete distribution against its pmf (support()):
+    samples are counted per value, neighbour values with expected count below
+    min_expected are pooled. Moments are compared when values are numbers.
+    '''
+    values, probabilities = distribution.support()
+    try:
+        keys = np.asarray(values, dtype=float)
+        order = np.argsort(keys)
+    except (TypeError, ValueError):
+        keys = None
+        index = {value: i for i, value in enumerate(values)}
+        lookup = np.vectorize(index.__getitem__, otypes=[np.int64])
+
+    counts = np.zeros(len(values), dtype=np.int64)
+    moments = Moments() if keys is not None else None
+    count = 0
+
+    start = time.perf_counter()
+    while count < samples:
+        chunk = distribution.sample(min(chunk_size, samples - count))
+        if keys is not None:
+            chunk = np.asarray(chunk, dtype=float)
+            positions = np.minimum(np.searchsorted(keys[order], chunk), len(keys) - 1)
+            if (keys[order][positions] != chunk).any():
+                raise ValueError('Sample outside of the support of the distribution')
+            counts += np.bincount(order[positions], minlength=len(values))
+            moments.add(chunk)
+        else:
+            counts += np.bincount(lookup(chunk), minlength=len(values))
+        count += len(chunk)
+    seconds = time.perf_counter() - start
+
+    # pool cells with small expected counts into their neighbours
+    observed, expected = [], []
+    cell_observed = cell_expected = 0.0
+    for cell_count, probability in zip(counts, probabilities):
+        cell_observed += cell_count
+        cell_expected += probability * count
+        if cell_expected >= min_expected:
+            observed.append(cell_observed)
+            expected.append(cell_expected)
+            cell_observed = cell_expected = 0.0
+    if cell_expected > 0 and expected:
+        observed[-1] += cell_observed
+        expected[-1] += cell_expected
+    observed, expected = np.array(observed), np.array(expected)
+    chi2 = float(((observed - expected) ** 2 / expected).sum())
+
+    mean = moments.mean if moments is not None else None
+    variance = moments.variance() if moments is not None else None
+    return ValidationReport(distribution, count, mean, variance, chi2, max(len(expected) - 1, 1), None, seconds)
+
+
+if __name__ == '__main__':
+    samples = 10 ** 7
+    rand = Rand(12345)
+    for distribution in [Exponential(2, rand), Normal(1, 0.3, rand), Uniform(3, 8, rand), Erlang(4.5, 3, rand),
+                         IntegerUniform(1, 6, rand), Discrete([1, 2, 5], [0.2, 0.5, 0.3], rand),
+                         Discrete(['first', 'second', 'third'], [0.5, 0.1, 0.4], rand)]:
+        validate(distribution, samples).print_report()
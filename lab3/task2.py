@@ -32,61 +32,76 @@ class BankLine(Process):
         self.delay_func = delay_func
         self.other_bank_line = None
 
-        # stats
-        self.mean_queue = 0
+        # stats, derived values are computed on read
         self.last_out_tcurr = 0
 
-        self.mean_load = 0 # tcurr / (quantity * mean_process_time)
-        
         self.between_out_act_sum = 0
         self.between_out_act_count = 0
-        self.between_out_act_avg = 0
 
-        
         self.mean_process_time_sum = 0
         self.mean_process_time_count = 0
-        self.mean_process_time = 0 # mean process time
-
-        self.mean_queue_time = 0 # mean queue * mean process time
-        self.mean_process_queue_time = 0 # mean process time + mean queue time
-
-        # mean queue
-
-        self.failure_rate = 0 # failure / quantity
 
         self.rebalance_count = 0
 
-    def do_statistics(self, delta):
-        super().do_statistics(delta)
-
-        if self.tcurr == 0 or self.quantity == 0 or self.mean_process_time_count == 0 or self.between_out_act_count == 0:
-            return
-
-        self.mean_process_time = self.mean_process_time_sum / self.mean_process_time_count
-
-        self.mean_queue = self.meanQueue / self.tcurr
-        self.mean_load = self.tcurr / self.quantity
-        self.between_out_act_avg = self.between_out_act_sum / self.between_out_act_count
-
-        self.mean_queue_time = self.mean_queue * self.mean_process_time
-        self.mean_process_queue_time = self.mean_process_time + self.mean_queue_time
+    def reset_statistics(self):
+        super().reset_statistics()
+        self.last_out_tcurr = self.tcurr
+        self.between_out_act_sum = 0
+        self.between_out_act_count = 0
+        self.mean_process_time_sum = 0
+        self.mean_process_time_count = 0
+        self.rebalance_count = 0
 
-        self.failure_rate = self.failure / (self.quantity + self.failure)
-    
+    @property
+    def mean_process_time(self):
+        if self.mean_process_time_count == 0:
+            return 0
+        return self.mean_process_time_sum / self.mean_process_time_count
+
+    @property
+    def mean_queue(self):
+        return self.get_mean_queue()
+
+    @property
+    def mean_load(self):
+        # time of statistics / quantity
+        if self.quantity == 0:
+            return 0
+        return (self.tcurr - self.tstat) / self.quantity
+
+    @property
+    def between_out_act_avg(self):
+        if self.between_out_act_count == 0:
+            return 0
+        return self.between_out_act_sum / self.between_out_act_count
+
+    @property
+    def mean_queue_time(self):
+        # mean queue * mean process time
+        return self.mean_queue * self.mean_process_time
+
+    @property
+    def mean_process_queue_time(self):
+        # mean process time + mean queue time
+        return self.mean_process_time + self.mean_queue_time
+
+    @property
+    def failure_rate(self):
+        return self.get_failure_probability()
 
     def in_act(self):
-        if self.get_free_device() is not None:
-            device = self.get_free_device()
-            device.state = State.BUSY
-            
+        device = self.get_free_device()
+        if device is not None:
+
             delay = self.delay_func()
             self.mean_process_time_sum += delay
             self.mean_process_time_count += 1
 
-            device.tnext = self.tcurr + delay
+            self.occupy_device(device, delay)
+            self.schedule()
         else:
             if self.queue < self.maxqueue:
-                self.queue += 1
+                self.put_in_queue()
             else:
                 self.failure += 1
 
@@ -97,26 +112,21 @@ class BankLine(Process):
         self.between_out_act_count += 1
         self.last_out_tcurr = self.tcurr
 
-        min_dev = self.get_min_device()
-        
-        min_dev.state = State.FREE
-        min_dev.tnext = float(sys.maxsize)
+        self.release_device(self.get_min_device())
         if self.queue > 0:
-            self.queue -= 1
-            free_device = self.get_free_device()
-            free_device.state = State.BUSY
-            free_device.tnext = self.tcurr + self.delay_func()
+            self.take_from_queue()
+            self.occupy_device(self.get_free_device(), self.delay_func())
 
         self.rebalance_queue()
 
     def rebalance_queue(self):
         if self.other_bank_line.queue > self.queue + 1:
-            self.other_bank_line.queue -= 1
-            self.queue += 1
+            self.other_bank_line.take_from_queue()
+            self.put_in_queue()
             self.rebalance_count += 1
         elif self.other_bank_line.queue < self.queue - 1:
-            self.other_bank_line.queue += 1
-            self.queue -= 1
+            self.other_bank_line.put_in_queue()
+            self.take_from_queue()
             self.rebalance_count += 1
 
     def print_stats(self):
@@ -132,11 +142,14 @@ class BankLine(Process):
 
 
 
-def main():
-    car_input = CarInput(lambda: Rand.exp(0.5), 'CarInput')
+def main(seed=None, warmup=None):
+    rand = Rand(seed)
+    car_rand, bank_line1_rand, bank_line2_rand = rand.spawn(3)
+
+    car_input = CarInput(Exponential(0.5, car_rand), 'CarInput')
 
-    bank_line1 = BankLine(lambda: Rand.exp(0.3), 'BankLine1', 3)
-    bank_line2 = BankLine(lambda: Rand.exp(0.3), 'BankLine2', 3)
+    bank_line1 = BankLine(Exponential(0.3, bank_line1_rand), 'BankLine1', 3)
+    bank_line2 = BankLine(Exponential(0.3, bank_line2_rand), 'BankLine2', 3)
 
     bank_line1.other_bank_line = bank_line2
     bank_line2.other_bank_line = bank_line1
@@ -144,12 +157,12 @@ def main():
     car_input.next_elements = [bank_line1, bank_line2]
 
     car_input.tnext = 0.1
-    bank_line1.tnext = Rand.norm(1, 0.3)
-    bank_line2.tnext = Rand.norm(1, 0.3)
+    bank_line1.tnext = rand.norm(1, 0.3)
+    bank_line2.tnext = rand.norm(1, 0.3)
     bank_line1.queue = 2
     bank_line2.queue = 2
     
-    model = Model([car_input, bank_line1, bank_line2], debug=False)
+    model = Model([car_input, bank_line1, bank_line2], debug=False, warmup=warmup)
     model.simulate(100)
 
 
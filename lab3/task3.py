@@ -2,9 +2,6 @@ from framework import *
 from rand import *
 
 from enum import Enum
-import numpy as np
-import copy
-from queue import PriorityQueue, Queue
 
 
 class SickType(Enum):
@@ -12,22 +9,21 @@ class SickType(Enum):
     SECOND = 2
     THIRD = 3
 
-class SickHuman:
-    def __init__(self, sick_type):
+class SickHuman(Entity):
+    __slots__ = ('sick_type',)
+
+    def __init__(self, sick_type, tcreate = 0.0):
+        super().__init__(0 if sick_type == SickType.FIRST else 1, tcreate)
         self.sick_type = sick_type
-    
-    # implement < so type 1 is highest priority
-    def __lt__(self, other):
-        if self.sick_type == SickType.FIRST and other.sick_type != SickType.FIRST:
-            return True
-        else:
-            return False
 
 
 class HumanInput(Create):
     # next element is expected to be Hospital
-    def __init__(self, name):
+    def __init__(self, name, rand=None, pool=None):
         super().__init__(0, name)
+        self.rand = rand if rand is not None else Rand.default()
+        # sick humans are reused after they leave the model
+        self.pool = pool if pool is not None else EntityPool(SickHuman)
         self.sick_type_distribution = {
             SickType.FIRST: 0.5,
             SickType.SECOND: 0.1,
@@ -40,6 +36,9 @@ class HumanInput(Create):
             SickType.THIRD: 30
         }
 
+        self.sick_type_sampler = Discrete(list(self.sick_type_distribution.keys()),
+                                          list(self.sick_type_distribution.values()), self.rand)
+
         self.sick_human_to_send = self._generate_next_sick()
         self.tnext = self.tcurr + self.sick_type_delay[self.sick_human_to_send.sick_type]
 
@@ -58,18 +57,12 @@ class HumanInput(Create):
         if len(self.next_elements) > 1:
             raise Exception('HumanInput has to have exactly 1 next element')
         
-        self.next_elements[0].in_act(copy.deepcopy(self.sick_human_to_send))
+        self.sick_human_to_send.move(self.next_elements[0])
         self.sick_human_to_send = sick_human
 
     def _generate_next_sick(self) -> SickHuman:
         # generate next sick dies to distribution
-        sick_type = np.random.choice(np.arange(1, 4), p=[
-            self.sick_type_distribution[SickType.FIRST],
-            self.sick_type_distribution[SickType.SECOND],
-            self.sick_type_distribution[SickType.THIRD]
-        ])
-
-        return SickHuman(SickType(sick_type))
+        return self.pool.acquire(self.sick_type_sampler(), self.tcurr)
     
     def get_mean_delay(self):
         if self.mean_delay_count != 0:
@@ -77,12 +70,17 @@ class HumanInput(Create):
         else:
             return -1
 
+    def reset_statistics(self):
+        super().reset_statistics()
+        self.mean_delay_sum = 0
+        self.mean_delay_count = 0
+
 
 class GeneralSickProcessor(Process):
-    def __init__(self, delay_func, name, maxqueue, devices_amount = 1):
-        super().__init__(None, name, maxqueue, devices_amount, 0)
+    def __init__(self, delay_func, name, maxqueue, devices_amount = 1, rand = None, discipline = 'fifo'):
+        super().__init__(None, name, maxqueue, devices_amount, 0, discipline)
+        self.rand = rand if rand is not None else Rand.default()
         self.sick_human = None
-        self.queue = Queue(maxqueue)
         self.delay_func = delay_func
 
         self.mean_delay_sum = 0
@@ -93,27 +91,25 @@ class GeneralSickProcessor(Process):
         
         self.last_in_act_tcurr = 0
 
-    def do_statistics(self, delta):
-        self.meanQueue += (self.queue.qsize() * delta)        
+    def reset_statistics(self):
+        super().reset_statistics()
+        self.mean_delay_sum = 0
+        self.mean_delay_count = 0
+        self.mean_between_in_act_sum = 0
+        self.mean_between_in_act_count = 0
 
     def print_info(self):
         print(f'Name: {self.name}, \
               Quantity: {self.quantity}, \
-              Queue: {self.queue.qsize()}, \
+              Queue: {self.queue}, \
               Maxqueue: {self.maxqueue}, \
               Failure: {self.failure}, \
-              MeanQueue: {((self.meanQueue/self.tcurr) if self.tcurr != 0.0 else (0.0)):.2f}, \
-              Failure probability: {((self.failure / (self.quantity + self.failure)) if (self.quantity + self.failure) > 0 else 0.0):.2f}')
+              MeanQueue: {self.get_mean_queue():.2f}, \
+              Failure probability: {self.get_failure_probability():.2f}')
         for device in self.devices:
             print(f'\tDevice: {device.name}, \
                   tnext: {device.tnext:.2f}, \
-                  state: {device.state}')
-    
-    def can_accept(self):
-        return self.queue.full() == False
-
-    def put_in_queue(self, sick_human):
-        raise Exception('Not implemented')
+                  state: {State(device.state)}')
 
     def get_delay_specific(self, sick_human = None):
         raise Exception('Not implemented')
@@ -131,43 +127,51 @@ class GeneralSickProcessor(Process):
             self.last_in_act_tcurr = self.tcurr
 
 
-        if self.get_free_device() is not None:
-            device = self.get_free_device()
-            device.state = State.BUSY
+        device = self.get_free_device()
+        if device is not None:
 
             tmp_delay = self.get_delay_specific(sick_human)
-            device.tnext = self.tcurr + tmp_delay
+            self.occupy_device(device, tmp_delay)
             device.data = sick_human
+            self.schedule()
 
             self.mean_delay_sum += tmp_delay
             self.mean_delay_count += 1
         else:
-            if self.queue.qsize() < self.maxqueue:
+            if self.queue < self.maxqueue:
                 self.put_in_queue(sick_human)
             else:
                 self.failure += 1
+                sick_human.release()
+
+    def send(self, element):
+        # moves processed sick human to element, or out of the model if element is None
+        sick_human = self.data_to_send
+        self.data_to_send = None
+        if element is None:
+            sick_human.release()
+        else:
+            sick_human.move(element)
 
     def out_act(self):
         self.quantity += 1
 
         min_dev = self.get_min_device()
         
-        min_dev.state = State.FREE
-        min_dev.tnext = float(sys.maxsize)
-        self.data_to_send = copy.deepcopy(min_dev.data)
+        self.release_device(min_dev)
+        self.data_to_send = min_dev.data
         min_dev.data = None
 
-        if self.queue.qsize() > 0:
-            element_to_attach = self.queue.get()
+        if self.queue > 0:
+            element_to_attach = self.take_from_queue()
 
             free_device = self.get_free_device()
-            free_device.state = State.BUSY
 
             tmp_delay = self.get_delay_specific(element_to_attach)
             if self.name == 'Room':
                 print(f'Room delay: {tmp_delay}')
 
-            free_device.tnext = self.tcurr + tmp_delay
+            self.occupy_device(free_device, tmp_delay)
             free_device.data = element_to_attach
 
             self.mean_delay_sum += tmp_delay
@@ -184,14 +188,8 @@ class GeneralSickProcessor(Process):
 
 class Hospital(GeneralSickProcessor):
     def __init__(self, delay_func, name, maxqueue):
-        super().__init__(delay_func, name, maxqueue, 2)
-        self.queue = PriorityQueue(maxqueue)
-
-    def put_in_queue(self, sick_human):
-        if sick_human.sick_type == SickType.FIRST:
-            self.queue.put(sick_human)
-        else:
-            self.queue.put(sick_human)
+        # sick humans of the first type are taken first
+        super().__init__(delay_func, name, maxqueue, 2, discipline='priority')
 
     def get_delay_specific(self, sick_human = None):
         return self.delay_func()
@@ -202,9 +200,9 @@ class Hospital(GeneralSickProcessor):
 
         try:
             if self.data_to_send.sick_type == SickType.FIRST:
-                self.next_elements[0].in_act(copy.deepcopy(self.data_to_send))
+                self.send(self.next_elements[0])
             else:
-                self.next_elements[1].in_act(copy.deepcopy(self.data_to_send))
+                self.send(self.next_elements[1])
         except:
             raise Exception('Hospital must use Room and LabReg as next elements')
 
@@ -218,24 +216,19 @@ class Room(GeneralSickProcessor): # post hospital room
     def __init__(self, delay_func, name, maxqueue):
         super().__init__(delay_func, name, maxqueue, 3)
 
-    def put_in_queue(self, sick_human):
-        self.queue.put(sick_human)
-
     def get_delay_specific(self, sick_human = None):
         return self.delay_func()
 
     def out_act(self):
         super().out_act()
         # no in act because it is last element
+        self.send(None)
 
 
 class LabReg(GeneralSickProcessor):
     def __init__(self, delay_func, name, maxqueue):
         super().__init__(delay_func, name, maxqueue, 1)
     
-    def put_in_queue(self, sick_human):
-        self.queue.put(sick_human)
-
     def get_delay_specific(self, sick_human = None):
         return self.delay_func()
     
@@ -246,15 +239,13 @@ class LabReg(GeneralSickProcessor):
             raise Exception('LabReg has to have exactly 1 next element')
         
         # send to Lab
-        self.next_elements[0].in_act(copy.deepcopy(self.data_to_send))
+        self.send(self.next_elements[0])
 
 class Lab(GeneralSickProcessor):
-    def __init__(self, delay_func, name, maxqueue):
-        super().__init__(delay_func, name, maxqueue, 2)
+    def __init__(self, delay_func, name, maxqueue, rand=None):
+        super().__init__(delay_func, name, maxqueue, 2, rand)
+        self.half_probability = Discrete([True, False], [0.5, 0.5], self.rand)
     
-    def put_in_queue(self, sick_human):
-        self.queue.put(sick_human)
-
     def get_delay_specific(self, sick_human = None):
         return self.delay_func()
     
@@ -262,10 +253,13 @@ class Lab(GeneralSickProcessor):
         if len(self.next_elements) != 1:
             raise Exception('Lab has to have exactly 1 next element')
         
-        if np.random.choice([True, False]):
-            sick_to_change = copy.deepcopy(self.data_to_send)
-            sick_to_change.sick_type = SickType.FIRST
-            self.next_elements[0].in_act(sick_to_change)
+        if self.half_probability():
+            # sick human is owned by lab here, so it is changed in place
+            self.data_to_send.sick_type = SickType.FIRST
+            self.data_to_send.priority = 0
+            self.send(self.next_elements[0])
+        else:
+            self.send(None)
 
     def out_act(self):
         super().out_act()
@@ -280,8 +274,6 @@ class PathToHospital(GeneralSickProcessor):
     def __init__(self, delay_func, name, maxqueue, devices_amount=1):
         super().__init__(delay_func, name, maxqueue, devices_amount)
 
-    def put_in_queue(self, sick_human):
-        self.queue.put(sick_human)
     
     def get_delay_specific(self, sick_human = None):
         return self.delay_func()
@@ -293,17 +285,20 @@ class PathToHospital(GeneralSickProcessor):
             raise Exception('PathToHospital has to have exactly 1 next element')
         
         # send to Hospital
-        self.next_elements[0].in_act(copy.deepcopy(self.data_to_send))
+        self.send(self.next_elements[0])
 
 
-if __name__ == '__main__':
-    human_input = HumanInput('HumanInput')
+def create_model(rand=None):
+    # independent stream for every element
+    input_rand, hospital_rand, room_rand, lab_reg_rand, lab_rand, path_rand = (rand or Rand()).spawn(6)
+
+    human_input = HumanInput('HumanInput', input_rand)
 
-    hospital = Hospital(lambda: Rand.exp(15), 'Hospital', 10)
-    room = Room(lambda: Rand.uniform(3, 8), 'Room', 10)
-    lab_reg = LabReg(lambda: Rand.erlang(4.5, 3), 'LabReg', 10)
-    lab = Lab(lambda: Rand.erlang(4, 2), 'Lab', 10)
-    path_to_hospital = PathToHospital(lambda: Rand.uniform(2, 5), 'PathToHospital', 10)
+    hospital = Hospital(Exponential(15, hospital_rand), 'Hospital', 10)
+    room = Room(Uniform(3, 8, room_rand), 'Room', 10)
+    lab_reg = LabReg(Erlang(4.5, 3, lab_reg_rand), 'LabReg', 10)
+    lab = Lab(Erlang(4, 2, lab_rand), 'Lab', 10, lab_rand)
+    path_to_hospital = PathToHospital(Uniform(2, 5, path_rand), 'PathToHospital', 10)
 
     human_input.next_elements = [hospital]
     hospital.next_elements = [room, lab_reg]
@@ -312,8 +307,13 @@ if __name__ == '__main__':
     lab.next_elements = [path_to_hospital]
     path_to_hospital.next_elements = [hospital]
 
-    model = Model([human_input, hospital, room, lab_reg, lab, path_to_hospital], debug=False)
+    return Model([human_input, hospital, room, lab_reg, lab, path_to_hospital], debug=False)
+
+
+if __name__ == '__main__':
+    model = create_model()
     model.simulate(1000)
+    human_input, hospital, room, lab_reg, lab, path_to_hospital = model.elements
 
     print('\n')
     print(f'Mean delay for:\n\
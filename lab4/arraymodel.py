@@ -0,0 +1,525 @@
+import sys
+import time
+import numpy as np
+from framework import *
+from rand import *
+
+
+class ArrayModel:
+    '''
+    Struct-of-arrays engine for networks of plain Create and Process elements.
+
+    Every element is a row of numpy arrays (delays, queue lengths, counters,
+    device completion times as (elements, max devices) matrix), routes are kept
+    as CSR arrays of destinations sorted by priority. One iteration handles all
+    events of the next event time together:
+
+    1. every device finishing at tcurr is released and takes one entity from
+       the queue of its process, every Create due at tcurr fires once,
+    2. destination of every departure is chosen by priority among next elements
+       which can accept (queue < maxqueue) in the state after step 1, as in
+       Element.get_next_element_with_highest_priority, all departures of one
+       element in an iteration go to the same destination,
+    3. arrivals of a destination occupy its free devices, then its queue up to
+       maxqueue, the rest are failures.
+
+    So departures at time t are handled before arrivals at the same t. The object
+    Model handles simultaneous events one by one in order of element ids, so an
+    element routing at t sees queues of destinations with larger ids before their
+    departures at t. Results are the same as of Model unless a queue is full at an
+    event time shared by a departure of that process and an arrival to it (or by
+    several arrivals competing for its last place): Model routes the arrival to the
+    next element by priority or counts a failure, here it is queued. E.g. fan-out,
+    where create (id 0) often fires together with completions, differs by a few
+    entities in quantity of low priority processes; chain and split are the same.
+    Delays are deterministic (delayMean), as in base Create and Process.
+
+    An iteration costs a few numpy calls whatever the number of its events, so the
+    engine pays off when many elements share event times (chains and splits of
+    lab4 with equal delays), with one event per time (fan-out) object Model is faster.
+    '''
+
+    def __init__(self, names, is_create, delay, tnext, devices, maxqueue, priority, route_ptr, route_dst):
+        self.names = list(names)
+        self.is_create = np.asarray(is_create, dtype=bool)
+        self.delay = np.asarray(delay, dtype=np.float64)
+        self.devices = np.asarray(devices, dtype=np.int64)
+        self.maxqueue = np.asarray(maxqueue, dtype=np.float64)
+        self.priority = np.asarray(priority, dtype=np.float64)
+        self.route_ptr = np.asarray(route_ptr, dtype=np.int64)
+        self.route_dst = np.asarray(route_dst, dtype=np.int64)
+
+        n = len(self.names)
+        if np.any(self.delay[~self.is_create] <= 0) or np.any(self.delay[self.is_create] <= 0):
+            raise ValueError('Delays of array model have to be positive')
+        if np.any(self.is_create[self.route_dst]):
+            raise ValueError('Create element can not be a destination')
+
+        self.degree = np.diff(self.route_ptr)
+        # routes of every element sorted by priority of destination, stable so the first
+        # of equal priority wins, first of original order is used when nothing accepts
+        self.route_first = np.full(n, -1, dtype=np.int64)
+        has_routes = self.degree > 0
+        self.route_first[has_routes] = self.route_dst[self.route_ptr[:-1][has_routes]]
+        for i in np.flatnonzero(self.degree > 1):
+            start, end = self.route_ptr[i], self.route_ptr[i + 1]
+            order = np.argsort(self.priority[self.route_dst[start:end]], kind='stable')
+            self.route_dst[start:end] = self.route_dst[start:end][order]
+
+        max_devices = max(1, int(self.devices.max())) if n > 0 else 1
+        self.device_valid = np.arange(max_devices) < self.devices[:, None]
+        self.device_tnext = np.full((n, max_devices), np.inf)
+        self.create_tnext = np.where(self.is_create, np.asarray(tnext, dtype=np.float64), np.inf)
+        self.tnext = self.create_tnext.copy()
+
+        self.queue = np.zeros(n, dtype=np.int64)
+        self.load = np.zeros(n, dtype=np.int64)
+        self.quantity = np.zeros(n, dtype=np.int64)
+        self.failure = np.zeros(n, dtype=np.int64)
+        # time-weighted integrals of queue and load, updated lazily
+        self.queue_area = np.zeros(n)
+        self.load_area = np.zeros(n)
+        self.tlast = np.zeros(n)
+
+        self.tcurr = 0.0
+        self.iterations = 0
+
+    @classmethod
+    def from_elements(cls, elements):
+        '''
+        Builds array model from Create/Process elements (or a Model), subclasses
+        are refused since their handlers can not be translated to arrays.
+        '''
+        if isinstance(elements, Model):
+            elements = elements.elements
+        elements = list(elements)
+        ids = {id(element): i for i, element in enumerate(elements)}
+
+        is_create, delay, tnext, devices, maxqueue, priority = [], [], [], [], [], []
+        route_ptr, route_dst = [0], []
+        for element in elements:
+            if type(element) is Create:
+                is_create.append(True)
+                devices.append(0)
+                maxqueue.append(0)
+                priority.append(0)
+            elif type(element) is Process:
+                is_create.append(False)
+                devices.append(element.devices_amount)
+                maxqueue.append(np.inf if element.maxqueue is None else element.maxqueue)
+                priority.append(element.priority)
+            else:
+                raise TypeError(f'{type(element).__name__} can not be converted to array model, '
+                                f'only Create and Process are supported')
+            delay.append(element.delayMean)
+            tnext.append(element.tnext)
+
+            for next_element in element.next_elements:
+                if id(next_element) not in ids:
+                    raise ValueError(f'Next element {next_element.name} of {element.name} is not in the model')
+                route_dst.append(ids[id(next_element)])
+            route_ptr.append(len(route_dst))
+
+        return cls([element.name for element in elements], is_create, delay, tnext,
+                   devices, maxqueue, priority, route_ptr, route_dst)
+
+    def accumulate(self, rows):
+        # adds time-weighted statistics of rows up to tcurr before their queue or load changes
+        dt = self.tcurr - self.tlast[rows]
+        self.queue_area[rows] += self.queue[rows] * dt
+        self.load_area[rows] += self.load[rows] * dt
+        self.tlast[rows] = self.tcurr
+
+    def occupy(self, rows, amount):
+        # occupies first amount free devices of every row, rows have to be unique
+        sub = self.device_tnext[rows]
+        free = self.device_valid[rows] & (sub == np.inf)
+        selected = free & (np.cumsum(free, axis=1) <= amount[:, None])
+        self.device_tnext[rows] = np.where(selected, (self.tcurr + self.delay[rows])[:, None], sub)
+        self.load[rows] += amount
+
+    def route(self, rows):
+        # destination of departures from rows, every row has at least one route
+        degree = self.degree[rows]
+        total = int(degree.sum())
+        starts = np.cumsum(degree) - degree
+        edges = np.repeat(self.route_ptr[rows] - starts, degree) + np.arange(total)
+
+        dst = self.route_dst[edges]
+        accepts = self.queue[dst] < self.maxqueue[dst]
+        first = np.minimum.reduceat(np.where(accepts, np.arange(total), total), starts)
+        return np.where(first < total, self.route_dst[edges[np.minimum(first, total - 1)]], self.route_first[rows])
+
+    def step(self):
+        t = self.tcurr
+        rows = np.flatnonzero(self.tnext == t)
+        creates = rows[self.is_create[rows]]
+        processes = rows[~self.is_create[rows]]
+
+        # departures: devices done at t take entities from queue
+        departures = np.zeros(len(rows), dtype=np.int64)
+        if len(processes) > 0:
+            self.accumulate(processes)
+            sub = self.device_tnext[processes]
+            done = sub == t
+            done_count = done.sum(axis=1)
+            self.device_tnext[processes] = np.where(done, np.inf, sub)
+            self.load[processes] -= done_count
+            self.quantity[processes] += done_count
+
+            pulled = np.minimum(done_count, self.queue[processes])
+            self.queue[processes] -= pulled
+            self.occupy(processes, pulled)
+            departures[~self.is_create[rows]] = done_count
+
+        if len(creates) > 0:
+            self.quantity[creates] += 1
+            self.create_tnext[creates] += self.delay[creates]
+            departures[self.is_create[rows]] = 1
+
+        # routing of departures of elements with routes
+        routed = self.degree[rows] > 0
+        sources = rows[routed]
+        if len(sources) > 0:
+            dst = self.route(sources)
+            targets, inverse = np.unique(dst, return_inverse=True)
+            arrivals = np.bincount(inverse, weights=departures[routed]).astype(np.int64)
+
+            self.accumulate(targets)
+            free = self.devices[targets] - self.load[targets]
+            into_devices = np.minimum(arrivals, free)
+            self.occupy(targets, into_devices)
+            rest = arrivals - into_devices
+            queued = np.minimum(rest, self.maxqueue[targets] - self.queue[targets]).astype(np.int64)
+            self.queue[targets] += queued
+            self.failure[targets] += rest - queued
+            changed = np.union1d(processes, targets)
+        else:
+            changed = processes
+
+        self.tnext[creates] = self.create_tnext[creates]
+        if len(changed) > 0:
+            self.tnext[changed] = self.device_tnext[changed].min(axis=1)
+
+    def simulate(self, time_modeling, logging = True):
+        i = 0
+        while self.tcurr < time_modeling:
+            t = self.tnext.min()
+            if t == np.inf:
+                break
+            self.tcurr = float(t)
+            self.step()
+            i += 1
+
+        self.iterations += i
+        if logging:
+            print('\n\nModeling finished!\n')
+            self.print_result()
+
+    def get_mean_queue(self):
+        tcurr = self.tcurr
+        area = self.queue_area + self.queue * (tcurr - self.tlast)
+        return area / tcurr if tcurr != 0.0 else np.zeros_like(area)
+
+    def get_mean_load(self):
+        tcurr = self.tcurr
+        area = self.load_area + self.load * (tcurr - self.tlast)
+        return area / tcurr if tcurr != 0.0 else np.zeros_like(area)
+
+    def get_failure_probability(self):
+        total = self.quantity + self.failure
+        return np.divide(self.failure, total, out=np.zeros(len(total)), where=total > 0)
+
+    def print_result(self):
+        mean_queue = self.get_mean_queue()
+        mean_load = self.get_mean_load()
+        failure_probability = self.get_failure_probability()
+        for i, name in enumerate(self.names):
+            if self.is_create[i]:
+                print(f'Name: {name}, Quantity: {self.quantity[i]}, tnext: {self.tnext[i]:.2f}')
+            else:
+                print(f'Name: {name}, \
+                      Quantity: {self.quantity[i]}, \
+                      Queue: {self.queue[i]}, \
+                      Failure: {self.failure[i]}, \
+                      MeanQueue: {mean_queue[i]:.2f}, \
+                      MeanLoad: {mean_load[i]:.2f}, \
+                      Failure probability: {failure_probability[i]:.2f}')
+
+
+class LockstepModel:
+    '''
+    Replications of one Create/Process network advanced together. State is kept
+    in arrays with a row per replication: device completion times (replications,
+    elements * devices), queues, counters and statistics (replications, elements).
+
+    Every iteration handles the earliest event of every replication that has not
+    reached time_modeling yet, so replications advance one event at a time as
+    the object Model does (events of equal time in order of element ids and
+    devices) while per event Python overhead is shared by all of them.
+
+    Delays are given per element as numbers or Exponential, Uniform, Normal and
+    Erlang distributions of rand module, their parameters are used to sample a
+    variate for all replications at once from rand stream of the engine.
+    '''
+    CONSTANT, EXPONENTIAL, UNIFORM, NORMAL, ERLANG = range(5)
+
+    def __init__(self, structure, replications, delays = None, rand = None):
+        self.structure = structure
+        self.replications = replications
+        self.rand = rand if rand is not None else Rand.default()
+        self.names = structure.names
+
+        n = len(structure.names)
+        self.is_create = structure.is_create
+        self.devices = structure.devices
+        self.maxqueue = structure.maxqueue
+        self.route_first = structure.route_first
+
+        # routes sorted by priority padded with -1 to the same length
+        max_degree = int(structure.degree.max()) if n > 0 else 0
+        self.routes = np.full((n, max(1, max_degree)), -1, dtype=np.int64)
+        for i in np.flatnonzero(structure.degree > 0):
+            start, end = structure.route_ptr[i], structure.route_ptr[i + 1]
+            self.routes[i, :end - start] = structure.route_dst[start:end]
+
+        self.kind = np.full(n, LockstepModel.CONSTANT, dtype=np.int64)
+        self.p1 = structure.delay.copy()
+        self.p2 = np.zeros(n)
+        for i, delay in (delays or {}).items():
+            self.set_delay(i, delay)
+
+        # create is a single device whose completion is the next arrival
+        self.slots = max(1, structure.device_valid.shape[1])
+        self.slot_valid = structure.device_valid[:, :self.slots].copy()
+        self.slot_valid[self.is_create, 0] = True
+
+        initial = np.full((n, self.slots), np.inf)
+        initial[self.is_create, 0] = structure.create_tnext[self.is_create]
+        self.tnext = np.tile(initial.reshape(-1), (replications, 1))
+
+        shape = (replications, n)
+        self.queue = np.zeros(shape, dtype=np.int64)
+        self.load = np.zeros(shape, dtype=np.int64)
+        self.quantity = np.zeros(shape, dtype=np.int64)
+        self.failure = np.zeros(shape, dtype=np.int64)
+        self.queue_area = np.zeros(shape)
+        self.load_area = np.zeros(shape)
+        self.tlast = np.zeros(shape)
+
+        self.tcurr = np.zeros(replications)
+        self.events = np.zeros(replications, dtype=np.int64)
+        self.finished = np.zeros(replications, dtype=bool)
+        self.iterations = 0
+
+    @classmethod
+    def from_elements(cls, elements, replications, delays = None, rand = None):
+        # delays maps elements to numbers or distributions, others use delayMean
+        if isinstance(elements, Model):
+            elements = elements.elements
+        elements = list(elements)
+        structure = ArrayModel.from_elements(elements)
+        indices = {id(element): i for i, element in enumerate(elements)}
+        delays = {indices[id(element)]: delay for element, delay in (delays or {}).items()}
+        return cls(structure, replications, delays, rand)
+
+    def set_delay(self, i, delay):
+        if isinstance(delay, Exponential):
+            self.kind[i], self.p1[i] = LockstepModel.EXPONENTIAL, delay.mean_time
+        elif isinstance(delay, Uniform):
+            self.kind[i], self.p1[i], self.p2[i] = LockstepModel.UNIFORM, delay.a, delay.b
+        elif isinstance(delay, Normal):
+            self.kind[i], self.p1[i], self.p2[i] = LockstepModel.NORMAL, delay.mean_time, delay.std_deviation
+        elif isinstance(delay, Erlang):
+            self.kind[i], self.p1[i], self.p2[i] = LockstepModel.ERLANG, delay.mean_time, delay.k
+        elif isinstance(delay, (int, float)):
+            self.kind[i], self.p1[i] = LockstepModel.CONSTANT, delay
+        else:
+            raise TypeError(f'Unsupported delay of {self.names[i]}: {type(delay).__name__}')
+
+    def sample(self, elements):
+        # one delay for every entry of elements
+        generator = self.rand.generator
+        kind = self.kind[elements]
+        p1 = self.p1[elements]
+        p2 = self.p2[elements]
+        out = p1.copy()
+
+        mask = kind == LockstepModel.EXPONENTIAL
+        if mask.any():
+            out[mask] = -p1[mask] * np.log1p(-generator.random(np.count_nonzero(mask)))
+        mask = kind == LockstepModel.UNIFORM
+        if mask.any():
+            out[mask] = p1[mask] + (p2[mask] - p1[mask]) * generator.random(np.count_nonzero(mask))
+        mask = kind == LockstepModel.NORMAL
+        if mask.any():
+            out[mask] = p1[mask] + p2[mask] * generator.normal(0.0, 1.0, np.count_nonzero(mask))
+        mask = kind == LockstepModel.ERLANG
+        if mask.any():
+            # sum of k exponentials, shapes differ between elements
+            k = p2[mask].astype(np.int64)
+            u = generator.random((len(k), int(k.max())))
+            logs = np.where(np.arange(u.shape[1]) < k[:, None], np.log1p(-u), 0.0)
+            out[mask] = -p1[mask] / k * logs.sum(axis=1)
+        return out
+
+    def accumulate(self, rows, elements):
+        # (rows, elements) pairs have to be unique
+        dt = self.tcurr[rows] - self.tlast[rows, elements]
+        self.queue_area[rows, elements] += self.queue[rows, elements] * dt
+        self.load_area[rows, elements] += self.load[rows, elements] * dt
+        self.tlast[rows, elements] = self.tcurr[rows]
+
+    def route(self, rows, elements):
+        # destination by priority among accepting next elements, -1 leaves the model
+        routes = self.routes[elements]
+        valid = routes >= 0
+        targets = np.where(valid, routes, 0)
+        accepts = valid & (self.queue[rows[:, None], targets] < self.maxqueue[targets])
+        first = accepts.argmax(axis=1)
+        return np.where(accepts.any(axis=1), routes[np.arange(len(rows)), first], self.route_first[elements])
+
+    def step(self, rows):
+        slots = self.slots
+        flat = self.tnext[rows]
+        index = flat.argmin(axis=1)
+        t = flat[np.arange(len(rows)), index]
+
+        ended = t == np.inf
+        if ended.any():
+            self.finished[rows[ended]] = True
+            rows, index, t = rows[~ended], index[~ended], t[~ended]
+
+        element = index // slots
+        self.tcurr[rows] = t
+        self.events[rows] += 1
+        self.accumulate(rows, element)
+        self.quantity[rows, element] += 1
+        delay = self.sample(element)
+
+        # create schedules next arrival, device takes next entity from queue or becomes free
+        creates = self.is_create[element]
+        self.tnext[rows[creates], index[creates]] = t[creates] + delay[creates]
+        processes = ~creates
+        rp, ep = rows[processes], element[processes]
+        waiting = self.queue[rp, ep] > 0
+        self.queue[rp[waiting], ep[waiting]] -= 1
+        self.load[rp[~waiting], ep[~waiting]] -= 1
+        self.tnext[rp, index[processes]] = np.where(waiting, t[processes] + delay[processes], np.inf)
+
+        # arrival to the destination
+        dst = self.route(rows, element)
+        moving = dst >= 0
+        rows, dst, t = rows[moving], dst[moving], t[moving]
+        if len(rows) == 0:
+            return
+        self.accumulate(rows, dst)
+
+        free = self.load[rows, dst] < self.devices[dst]
+        candidates = dst[:, None] * slots + np.arange(slots)
+        idle = (self.tnext[rows[:, None], candidates] == np.inf) & self.slot_valid[dst]
+        slot = candidates[np.arange(len(rows)), idle.argmax(axis=1)]
+        self.tnext[rows[free], slot[free]] = t[free] + self.sample(dst[free])
+        self.load[rows[free], dst[free]] += 1
+
+        queued = ~free & (self.queue[rows, dst] < self.maxqueue[dst])
+        self.queue[rows[queued], dst[queued]] += 1
+        failed = ~free & ~queued
+        self.failure[rows[failed], dst[failed]] += 1
+
+    def simulate(self, time_modeling, logging = True):
+        i = 0
+        while True:
+            rows = np.flatnonzero((self.tcurr < time_modeling) & ~self.finished)
+            if len(rows) == 0:
+                break
+            self.step(rows)
+            i += 1
+
+        # as in Model, the other events of the last event time are handled too
+        while True:
+            rows = np.flatnonzero((self.tnext.min(axis=1) == self.tcurr) & ~self.finished)
+            if len(rows) == 0:
+                break
+            self.step(rows)
+            i += 1
+
+        self.iterations += i
+        if logging:
+            print('\n\nModeling finished!\n')
+            self.print_result()
+
+    def get_mean_queue(self):
+        tcurr = self.tcurr[:, None]
+        area = self.queue_area + self.queue * (tcurr - self.tlast)
+        return np.divide(area, tcurr, out=np.zeros_like(area), where=tcurr != 0.0)
+
+    def get_mean_load(self):
+        tcurr = self.tcurr[:, None]
+        area = self.load_area + self.load * (tcurr - self.tlast)
+        return np.divide(area, tcurr, out=np.zeros_like(area), where=tcurr != 0.0)
+
+    def get_failure_probability(self):
+        total = self.quantity + self.failure
+        return np.divide(self.failure, total, out=np.zeros(total.shape), where=total > 0)
+
+    def print_result(self):
+        # mean and standard deviation over replications
+        metrics = {
+            'Quantity': self.quantity,
+            'Failure': self.failure,
+            'MeanQueue': self.get_mean_queue(),
+            'MeanLoad': self.get_mean_load(),
+            'Failure probability': self.get_failure_probability(),
+        }
+        print(f'Replications: {self.replications}, events per replication: {self.events.mean():.1f}')
+        for i, name in enumerate(self.names):
+            print(f'Name: {name}')
+            for metric, values in metrics.items():
+                if self.is_create[i] and metric != 'Quantity':
+                    continue
+                print(f'\t{metric}: {values[:, i].mean():.4f} (std {values[:, i].std():.4f})')
+
+
+def chain(n, delay = 1, max_queue = 10, devices = 1):
+    # Create -> process0 -> ... -> process(n-1) built directly as arrays, without element objects
+    names = ['create'] + [f'process{i}' for i in range(n)]
+    is_create = np.zeros(n + 1, dtype=bool)
+    is_create[0] = True
+    route_ptr = np.concatenate([np.arange(n + 1), [n]])
+    route_dst = np.arange(1, n + 1)
+    return ArrayModel(names, is_create, np.full(n + 1, delay, dtype=np.float64), np.zeros(n + 1),
+                      np.r_[0, np.full(n, devices)], np.r_[0, np.full(n, max_queue)],
+                      np.zeros(n + 1), route_ptr, route_dst)
+
+
+def lab2_model():
+    # Create -> Process1 -> {Process2, Process3} of lab2/main.py
+    create = Create(0.2, 'Create')
+    process1 = Process(1, 'Process1', 10, 2)
+    process2 = Process(0.6, 'Process2', 10, 1)
+    process3 = Process(0.6, 'Process3', 10, 1)
+    create.next_elements = [process1]
+    process1.next_elements = [process2, process3]
+    return Model([create, process1, process2, process3])
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    start = time.perf_counter()
+    model = chain(n)
+    built = time.perf_counter()
+    model.simulate(1000, logging=False)
+    end = time.perf_counter()
+    print(f'{n} processes: built in {built - start:.2f} s, {model.iterations} iterations, '
+          f'{int(model.quantity[1:].sum())} events in {end - built:.2f} s')
+
+    # lab2 network with exponential delays of the same means, 1000 replications in lockstep
+    model = lab2_model()
+    delays = {element: Exponential(element.delayMean) for element in model.elements}
+    lockstep = LockstepModel.from_elements(model, 1000, delays, Rand(2024))
+    start = time.perf_counter()
+    lockstep.simulate(1000, logging=False)
+    end = time.perf_counter()
+    print(f'{lockstep.replications} replications: {int(lockstep.events.sum())} events in {end - start:.2f} s')
+    lockstep.print_result()
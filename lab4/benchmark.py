@@ -0,0 +1,211 @@
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from framework import *
+from arraymodel import ArrayModel
+
+
+# topologies from task1-2-4.ipynb plus fan-out and lab2 like feedback loops
+
+def create_n_model(n, delay = 1, max_queue = 10, calendar = 'heap'):
+    create = Create(delay, 'create')
+    processes = []
+
+    for i in range(n):
+        processes.append(Process(delay, 'process' + str(i), max_queue))
+
+    create.next_elements = [processes[0]]
+    for i in range(n - 1):
+        processes[i].next_elements = [processes[i + 1]]
+
+    return Model([create] + processes, calendar=calendar)
+
+
+def create_n_model_different_structure(n, delay = 1, max_queue = 10, calendar = 'heap'):
+    create = Create(delay, 'create')
+
+    processes1 = []
+    for i in range(int(n/2)):
+        processes1.append(Process(delay, 'process' + str(i), max_queue))
+
+    processes2 = []
+    for i in range(int(n/2)):
+        processes2.append(Process(delay, 'process' + str(i), max_queue))
+
+    create.next_elements = [processes1[0], processes2[0]]
+    for i in range(int(n/2 - 1)):
+        processes1[i].next_elements = [processes1[i + 1]]
+        processes2[i].next_elements = [processes2[i + 1]]
+
+    return Model([create] + processes1 + processes2, calendar=calendar)
+
+
+def create_fan_out_model(n, delay = 1, max_queue = 10, calendar = 'heap'):
+    # create is n times faster than a process, overflow goes to the next process by priority
+    create = Create(delay / n, 'create')
+    processes = [Process(delay, 'process' + str(i), max_queue, priority=i) for i in range(n)]
+    create.next_elements = processes
+
+    return Model([create] + processes, calendar=calendar)
+
+
+def create_feedback_model(n, delay = 1, max_queue = 10, calendar = 'heap'):
+    # n/3 blocks of lab2 model: process1 -> process2 / process3, process2 -> process1,
+    # process3 -> process1 of the next block
+    create = Create(0.2 * delay, 'create')
+    elements = [create]
+    previous = create
+    for block in range(max(1, n // 3)):
+        process1 = Process(delay, f'process1.{block}', max_queue, 2)
+        process2 = Process(0.6 * delay, f'process2.{block}', max_queue, 1, priority=1)
+        process3 = Process(0.6 * delay, f'process3.{block}', max_queue, 1, priority=2)
+
+        previous.next_elements = [process1]
+        process1.next_elements = [process2, process3]
+        process2.next_elements = [process1]
+
+        elements += [process1, process2, process3]
+        previous = process3
+
+    return Model(elements, calendar=calendar)
+
+
+TOPOLOGIES = {
+    'chain': create_n_model,
+    'split': create_n_model_different_structure,
+    'fan-out': create_fan_out_model,
+    'feedback': create_feedback_model,
+}
+
+
+def build(topology, n, calendar, engine):
+    model = TOPOLOGIES[topology](n, calendar=calendar)
+    if engine == 'array':
+        return ArrayModel.from_elements(model)
+    return model
+
+
+def count_events(model):
+    # events handled by the run: arrivals of creates and service completions of processes,
+    # model.iterations counts distinct event times only
+    if isinstance(model, ArrayModel):
+        return int(model.quantity.sum())
+    return sum(element.quantity for element in model.elements)
+
+
+def run_case(topology, n, time_modeling, calendar, repeat, engine = 'object'):
+    # best of repeat runs, memory is measured in a separate run since tracemalloc slows it down
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        model = build(topology, n, calendar, engine)
+        built = time.perf_counter()
+        model.simulate(time_modeling, logging=False)
+        end = time.perf_counter()
+
+        if best is None or end - built < best['wall_time']:
+            best = {
+                'build_time': built - start,
+                'wall_time': end - built,
+                'events': count_events(model),
+                'iterations': model.iterations,
+            }
+
+    tracemalloc.start()
+    model = build(topology, n, calendar, engine)
+    model.simulate(time_modeling, logging=False)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    best.update({
+        'topology': topology,
+        'size': n,
+        'calendar': calendar,
+        'engine': engine,
+        'events_per_second': best['events'] / best['wall_time'],
+        'us_per_event': best['wall_time'] / best['events'] * 1e6,
+        'peak_memory': peak,
+    })
+    return best
+
+
+def case_key(result):
+    # array engine has no calendar, results saved before engines were added are object ones
+    if result.get('engine', 'object') == 'array':
+        return f"{result['topology']}/{result['size']}/array"
+    return f"{result['topology']}/{result['size']}/{result['calendar']}"
+
+
+def compare(results, baseline, threshold):
+    # returns keys of cases where per event cost grew more than threshold
+    if baseline.get('events') != 'handled':
+        print('Baseline counts event times instead of handled events, save it again with --output')
+        return []
+    baseline_results = {case_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        key = case_key(result)
+        if key not in baseline_results:
+            continue
+        old = baseline_results[key]['us_per_event']
+        change = result['us_per_event'] / old - 1
+        status = 'REGRESSION' if change > threshold else 'ok'
+        print(f'{key}: {old:.2f} -> {result["us_per_event"]:.2f} us/event ({change:+.1%}) {status}')
+        if change > threshold:
+            regressions.append(key)
+    return regressions
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Scaling benchmark of framework models')
+    parser.add_argument('--topologies', nargs='+', default=list(TOPOLOGIES), choices=list(TOPOLOGIES))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10, 50, 100, 200, 500])
+    parser.add_argument('--calendars', nargs='+', default=['heap'], choices=['heap', 'scan'])
+    parser.add_argument('--engines', nargs='+', default=['object'], choices=['object', 'array'],
+                        help='object Model or struct-of-arrays ArrayModel')
+    parser.add_argument('--time', type=float, default=1000, help='time of modeling')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write results to this json file')
+    parser.add_argument('--baseline', help='compare with results saved earlier by --output')
+    parser.add_argument('--threshold', type=float, default=0.1, help='allowed relative growth of us per event')
+    args = parser.parse_args(argv)
+
+    results = []
+    for topology in args.topologies:
+        for n in args.sizes:
+            cases = [(calendar, 'object') for calendar in args.calendars if 'object' in args.engines]
+            if 'array' in args.engines:
+                cases.append((args.calendars[0], 'array'))
+            for calendar, engine in cases:
+                result = run_case(topology, n, args.time, calendar, args.repeat, engine)
+                results.append(result)
+                print(f'{case_key(result)}: {result["events"]} events, {result["wall_time"]:.3f} s, '
+                      f'{result["events_per_second"]:.0f} events/s, {result["us_per_event"]:.2f} us/event, '
+                      f'peak {result["peak_memory"] / 1024:.0f} KiB')
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'time_modeling': args.time,
+                # events are handled events (count_events), not event times
+                'events': 'handled',
+                'results': results,
+            }, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f'{len(regressions)} regressions over {args.threshold:.0%}')
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,14 @@
 import time
-import random
+import heapq
+import bisect
+import operator
+import struct
+import pickle
+import copyreg
+import zlib
+from collections import deque
 import numpy as np
+from rand import Uniform
 from enum import Enum
 import sys
 
@@ -10,32 +18,74 @@ class State(Enum):
     BUSY = 1
 
 
+# integer state codes stored in elements and devices, State(code) is used only for printing
+FREE = State.FREE.value
+BUSY = State.BUSY.value
+
+
 class Element:
+    # subclasses without __slots__ (BankLine, MainEOM, ...) get __dict__ for their own attributes
+    __slots__ = ('model', 'name', 'tnext', '_tcurr', 'delayMean', 'state', 'next_elements',
+                 'id', 'quantity', 'profiler')
+
     def __init__(self, delay):
+        self.model = None
         self.name = ''
         self.tnext = 0.0
         self.tcurr = 0.0
         self.delayMean = delay
-        self.state = State.FREE
+        self.state = FREE
         self.next_elements = []
         self.id = 0
         self.quantity = 0
+        self.profiler = None
     
     def __init__(self, delay, name):
+        self.model = None
         self.name = name
         self.tnext = 0.0
         self.tcurr = 0.0
         self.delayMean = delay
-        self.state = State.FREE
+        self.state = FREE
         self.next_elements = []
         self.id = 0
         self.quantity = 0
+        self.profiler = None
+
+    @property
+    def tcurr(self):
+        # clock is shared by the model, own value is used only outside of a model,
+        # handlers called on every event read self.model.tcurr directly
+        if self.model is not None:
+            return self.model.tcurr
+        return self._tcurr
+
+    @tcurr.setter
+    def tcurr(self, value):
+        self._tcurr = value
+
+    @property
+    def tstat(self):
+        # time statistics are collected from, moved by Model.reset_statistics after warm-up
+        if self.model is not None:
+            return self.model.tstat
+        return 0.0
+
+    def reset_statistics(self):
+        # called at the end of warm-up, subclasses reset their own accumulators and call super()
+        self.quantity = 0
 
     def in_act(self):
         pass
     
     def out_act(self):
         self.quantity += 1
+
+    def schedule(self):
+        # has to be called when tnext of element changes outside of out_act_all,
+        # so event calendar of the model will be updated
+        if self.model is not None:
+            self.model.reschedule(self)
     
     def out_act_all(self, tcurr_next = None):
         pass
@@ -48,7 +98,9 @@ class Element:
               delayMean: {self.delayMean:.2f}')
     
     def do_statistics(self, delta):
-        raise NotImplementedError()
+        # statistics are accumulated lazily when state changes,
+        # override only if element needs to be called on every event
+        pass
 
     def get_tnext(self):
         raise NotImplementedError()
@@ -74,22 +126,34 @@ class Element:
                 ret_element = element
         return ret_element
     
-    def in_act_for_highest_priority_and_acceptable(self):
+    def in_act_for_highest_priority_and_acceptable(self, entity = None):
+        # entity is passed only when there is one, so elements with in_act(self) still work
         el = self.get_next_element_with_highest_priority()
         if el is None:
             if len(self.next_elements) > 0:
-                self.next_elements[0].in_act()
-        else:
+                el = self.next_elements[0]
+            elif entity is not None:
+                # entity leaves the model
+                entity.release()
+                return
+            else:
+                return
+
+        if entity is None:
             el.in_act()
+        else:
+            entity.move(el)
 
 
 class Create(Element):
+    __slots__ = ()
+
     def __init__(self, delay, name):
         super().__init__(delay, name)
     
     def out_act(self):
         super().out_act()
-        self.tnext = self.tcurr + self.delayMean
+        self.tnext = self.model.tcurr + self.delayMean
 
         self.in_act_for_highest_priority_and_acceptable()
     
@@ -97,15 +161,12 @@ class Create(Element):
         if self.tnext == tcurr_next:
             self.out_act()
 
-    def do_statistics(self, delta):
-        pass
-
     def get_tnext(self):
         return self.tnext
 
     def print_info(self):
         super().print_info()
-        print(f'\tState: {self.state}')
+        print(f'\tState: {State(self.state)}')
     
     def get_priority(self):
         raise NotImplementedError('Create element has no priority')
@@ -114,66 +175,324 @@ class Create(Element):
         raise NotImplementedError('Create element cant accept')
 
 
+class Entity:
+    # transaction moving through the model, it is owned by exactly one element (or device)
+    # at a time and is moved between elements by reference, never copied
+    __slots__ = ('id', 'priority', 'tcreate', 'tenter', 'pool')
+
+    # id of the next entity
+    ids = 0
+
+    def __init__(self, priority = 0, tcreate = 0.0):
+        self.id = Entity.ids
+        Entity.ids += 1
+        self.priority = priority
+        self.tcreate = tcreate
+        # time of entering the current owner
+        self.tenter = tcreate
+        if not hasattr(self, 'pool'):
+            self.pool = None
+
+    def move(self, element):
+        # transfers ownership to element, sender must not use the entity afterwards
+        self.tenter = element.model.tcurr
+        element.in_act(self)
+
+    def release(self):
+        # entity left the model, it goes back to its pool if it was taken from one
+        if self.pool is not None:
+            self.pool.release(self)
+
+    def __repr__(self):
+        return f'{type(self).__name__}(id={self.id}, priority={self.priority}, tcreate={self.tcreate:.2f})'
+
+
+class EntityPool:
+    # free list of entities of one class, released entities are reinitialised instead of allocated
+    def __init__(self, cls = Entity, capacity = 1024):
+        self.cls = cls
+        self.capacity = capacity
+        self.free = []
+        self.allocated = 0
+        self.reused = 0
+
+    def acquire(self, *args, **kwargs):
+        if self.free:
+            entity = self.free.pop()
+            entity.__init__(*args, **kwargs)
+            self.reused += 1
+        else:
+            entity = self.cls(*args, **kwargs)
+            entity.pool = self
+            self.allocated += 1
+        return entity
+
+    def release(self, entity):
+        if len(self.free) < self.capacity:
+            self.free.append(entity)
+
+
+class EntityQueue:
+    # queue of entities waiting for a device, single threaded so no locks are taken,
+    # capacity is controlled by maxqueue of the process
+    def put(self, entity):
+        raise NotImplementedError()
+
+    def take(self):
+        raise NotImplementedError()
+
+    def __len__(self):
+        return len(self.entities)
+
+
+class FifoQueue(EntityQueue):
+    def __init__(self):
+        self.entities = deque()
+
+    def put(self, entity):
+        self.entities.append(entity)
+
+    def take(self):
+        return self.entities.popleft()
+
+
+class LifoQueue(EntityQueue):
+    def __init__(self):
+        self.entities = []
+
+    def put(self, entity):
+        self.entities.append(entity)
+
+    def take(self):
+        return self.entities.pop()
+
+
+class PriorityQueue(EntityQueue):
+    # lower priority value is taken first (as priority of elements),
+    # entities of equal priority are taken in FIFO order
+    def __init__(self):
+        self.entities = []
+        self.counter = 0
+
+    def put(self, entity):
+        self.counter += 1
+        heapq.heappush(self.entities, (entity.priority, self.counter, entity))
+
+    def take(self):
+        return heapq.heappop(self.entities)[-1]
+
+
+class RandomQueue(EntityQueue):
+    # uniform is a function returning uniform variate in [0, 1), Uniform(0, 1, rand) by default,
+    # rand is the default stream of Rand when it is not given
+    def __init__(self, uniform = None, rand = None):
+        self.entities = []
+        self.uniform = uniform if uniform is not None else Uniform(0, 1, rand)
+
+    def put(self, entity):
+        self.entities.append(entity)
+
+    def take(self):
+        entities = self.entities
+        i = int(self.uniform() * len(entities))
+        # swap with the last one, so removal is O(1)
+        entities[i], entities[-1] = entities[-1], entities[i]
+        return entities.pop()
+
+
+QUEUE_DISCIPLINES = {
+    'fifo': FifoQueue,
+    'lifo': LifoQueue,
+    'priority': PriorityQueue,
+    'random': RandomQueue,
+}
+
+
+# one shared object for tnext of all free devices
+NEVER = float(sys.maxsize)
+
+
 class Device:
+    __slots__ = ('name', 'tnext', 'state', 'data', 'entry')
+
+    # default names are shared between processes instead of a string per device
+    names = []
+
     def __init__(self, name):
         self.name = name
-        self.tnext = float(sys.maxsize)
-        self.state = State.FREE
+        self.tnext = NEVER
+        self.state = FREE
         
         self.data = None
+        # entry in busy devices heap of the process
+        self.entry = None
+
+    @staticmethod
+    def default_name(i):
+        names = Device.names
+        while len(names) <= i:
+            names.append(f'Device({len(names)})')
+        return names[i]
 
 
 class Process(Element):
-    def __init__(self, delay, name, maxqueue, devices_amount = 1, priority = 0):
+    __slots__ = ('queue', 'meanQueue', 'queue_tlast', 'load', 'meanLoad', 'load_tlast', 'maxqueue', 'discipline', 'entities', 'rand', 'failure', 'priority',
+                 'devices', 'devices_amount', 'free_devices', 'busy_devices', 'busy_counter')
+
+    def __init__(self, delay, name, maxqueue, devices_amount = 1, priority = 0, discipline = 'fifo', rand = None):
         super().__init__(delay, name)
+        # integrals of queue length and of busy devices over time up to queue_tlast and load_tlast,
+        # they are added to only when queue or load changes, so queue has to be changed
+        # by put_in_queue and take_from_queue once the model runs
         self.queue = 0
+        self.meanQueue = 0.0
+        self.queue_tlast = 0.0
+        self.load = 0
+        self.meanLoad = 0.0
+        self.load_tlast = 0.0
         self.maxqueue = maxqueue
+        # entities waiting in queue, discipline is a name from QUEUE_DISCIPLINES or EntityQueue,
+        # queue stays the length used for statistics. Named queue is created with the first entity,
+        # so processes of models without entities do not keep an empty one
+        self.discipline = discipline
+        if isinstance(discipline, EntityQueue):
+            self.entities = discipline
+        elif discipline in QUEUE_DISCIPLINES:
+            self.entities = None
+        else:
+            raise ValueError(f'Unknown queue discipline: {discipline}, expected one of {list(QUEUE_DISCIPLINES)}')
+        # stream of 'random' discipline, the default stream of Rand is used when it is None
+        self.rand = rand
         self.failure = 0
-        self.meanQueue = 0
         self.priority = priority
 
         self.devices = []
         self.devices_amount = devices_amount
         for i in range(devices_amount):
-            self.devices.append(Device(f'Device({i})'))
+            self.devices.append(Device(Device.default_name(i)))
+
+        # device pools: stack of free devices and min-heap of busy ones by tnext,
+        # devices have to be changed only by occupy_device and release_device
+        self.free_devices = list(reversed(self.devices))
+        self.busy_devices = []
+        self.busy_counter = 0
+
+    def queue_integral(self):
+        # integral of queue length over time up to tcurr
+        return self.meanQueue + self.queue * (self.tcurr - self.queue_tlast)
+
+    def load_integral(self):
+        return self.meanLoad + self.load * (self.tcurr - self.load_tlast)
+
+    def get_mean_queue(self):
+        duration = self.tcurr - self.tstat
+        return self.queue_integral() / duration if duration != 0.0 else 0.0
+
+    def get_mean_load(self):
+        # mean amount of busy devices
+        duration = self.tcurr - self.tstat
+        return self.load_integral() / duration if duration != 0.0 else 0.0
+
+    def reset_statistics(self):
+        super().reset_statistics()
+        self.failure = 0
+        self.meanQueue = 0.0
+        self.queue_tlast = self.tcurr
+        self.meanLoad = 0.0
+        self.load_tlast = self.tcurr
+
+    def get_failure_probability(self):
+        return self.failure / (self.quantity + self.failure) if (self.quantity + self.failure) > 0 else 0.0
 
     def get_priority(self):
         return self.priority
     
     def can_accept(self):
-        return self.queue < self.maxqueue
+        return self.maxqueue is None or self.queue < self.maxqueue
+
+    def put_in_queue(self, entity = None):
+        # queue without entity only counts waiting, as in models without entities
+        if entity is not None:
+            if self.entities is None:
+                if self.discipline == 'random':
+                    self.entities = RandomQueue(rand=self.rand)
+                else:
+                    self.entities = QUEUE_DISCIPLINES[self.discipline]()
+            self.entities.put(entity)
+        tcurr = self.model.tcurr
+        self.meanQueue += self.queue * (tcurr - self.queue_tlast)
+        self.queue_tlast = tcurr
+        self.queue += 1
+
+    def take_from_queue(self):
+        tcurr = self.model.tcurr
+        self.meanQueue += self.queue * (tcurr - self.queue_tlast)
+        self.queue_tlast = tcurr
+        self.queue -= 1
+        return self.entities.take() if self.entities else None
 
     def get_free_device(self):
-        for device in self.devices:
-            if device.state == State.FREE:
-                return device
-        return None
+        return self.free_devices[-1] if self.free_devices else None
 
-    def in_act(self):
+    def occupy_device(self, device, delay):
+        if self.free_devices[-1] is device:
+            self.free_devices.pop()
+        else:
+            self.free_devices.remove(device)
+
+        tcurr = self.model.tcurr
+        device.state = BUSY
+        device.tnext = tcurr + delay
+        self.busy_counter += 1
+        device.entry = [device.tnext, self.busy_counter, device]
+        heapq.heappush(self.busy_devices, device.entry)
+        self.meanLoad += self.load * (tcurr - self.load_tlast)
+        self.load_tlast = tcurr
+        self.load += 1
+
+    def release_device(self, device):
+        if device.state == BUSY:
+            device.entry[-1] = None
+            device.entry = None
+            self.free_devices.append(device)
+            tcurr = self.model.tcurr
+            self.meanLoad += self.load * (tcurr - self.load_tlast)
+            self.load_tlast = tcurr
+            self.load -= 1
+        device.state = FREE
+        device.tnext = NEVER
+
+    def in_act(self, entity = None):
         super().in_act()
-        if self.get_free_device() is not None:
-            device = self.get_free_device()
-            device.state = State.BUSY
-            device.tnext = self.tcurr + self.delayMean
+        device = self.get_free_device()
+        if device is not None:
+            self.occupy_device(device, self.delayMean)
+            device.data = entity
+            self.schedule()
         else:
-            if self.queue < self.maxqueue:
-                self.queue += 1
+            if self.can_accept():
+                self.put_in_queue(entity)
             else:
                 self.failure += 1
+                if entity is not None:
+                    entity.release()
     
     def get_min_device(self):
-        tmp_tnext = float(sys.maxsize)
-        ret_device = None
-        for device in self.devices:
-            if device.tnext < tmp_tnext:
-                tmp_tnext = device.tnext
-                ret_device = device
-        return ret_device
+        busy_devices = self.busy_devices
+        while busy_devices:
+            device = busy_devices[0][-1]
+            if device is not None:
+                return device
+            heapq.heappop(busy_devices)
+        return None
 
     def out_act_all(self, tcurr_next=None):
-        for device in self.devices:
-            if device.tnext == tcurr_next:
-                self.out_act()
+        # at most one out_act per device busy at the moment
+        for _ in range(self.load):
+            device = self.get_min_device()
+            if device is None or device.tnext != tcurr_next:
+                break
+            self.out_act()
 
 
     def out_act(self):
@@ -181,79 +500,611 @@ class Process(Element):
 
         min_dev = self.get_min_device()
         
-        min_dev.state = State.FREE
-        min_dev.tnext = float(sys.maxsize)
+        self.release_device(min_dev)
+        entity = min_dev.data
+        min_dev.data = None
         if self.queue > 0:
-            self.queue -= 1
-            free_device = self.get_free_device()
-            free_device.state = State.BUSY
-            free_device.tnext = self.tcurr + self.delayMean
-
-        self.in_act_for_highest_priority_and_acceptable()
+            device = self.get_free_device()
+            self.occupy_device(device, self.delayMean)
+            device.data = self.take_from_queue()
 
-    def do_statistics(self, delta):
-        self.meanQueue += (self.queue * delta)
+        self.in_act_for_highest_priority_and_acceptable(entity)
     
     def get_tnext(self):
-        tmp_tnext = float(sys.maxsize)
-        for device in self.devices:
-            if device.tnext < tmp_tnext:
-                tmp_tnext = device.tnext
-        return tmp_tnext
+        # get_min_device inlined, it is called for every event by the calendar
+        busy_devices = self.busy_devices
+        while busy_devices:
+            device = busy_devices[0][-1]
+            if device is not None:
+                return device.tnext
+            heapq.heappop(busy_devices)
+        return NEVER
     
     def print_info(self):
         super().print_info()
         print(f'Queue: {self.queue}, \
               Maxqueue: {self.maxqueue}, \
               Failure: {self.failure}, \
-              MeanQueue: {((self.meanQueue/self.tcurr) if self.tcurr != 0.0 else (0.0)):.2f}, \
-              Failure probability: {((self.failure / (self.quantity + self.failure)) if (self.quantity + self.failure) > 0 else 0.0):.2f}')
+              MeanQueue: {self.get_mean_queue():.2f}, \
+              MeanLoad: {self.get_mean_load():.2f}, \
+              Failure probability: {self.get_failure_probability():.2f}')
         for device in self.devices:
             print(f'\tDevice: {device.name}, \
                   tnext: {device.tnext:.2f}, \
-                  state: {device.state}')
+                  state: {State(device.state)}')
+
+
+class EventCalendar:
+    # future event list: min-heap of distinct event times, every time has a bucket of ids of elements
+    # with an event at it, so elements sharing event times cost one heap operation per time.
+    # planned[id] is the time of the live event of element id, ids left in other buckets are stale
+    def __init__(self, elements):
+        self.elements = list(elements)
+        self.clear()
+
+    def clear(self):
+        self.planned = [NEVER] * len(self.elements)
+        self.times = []
+        self.buckets = {}
+        # bucket being dispatched, its time and iterator over it
+        self.current = None
+        self.tcurr = None
+        self.iterator = None
+
+    def schedule(self, element, tnext):
+        i = element.id
+        if self.planned[i] == tnext:
+            return
+        self.planned[i] = tnext
+        if tnext >= NEVER:
+            return
+        if tnext == self.tcurr:
+            # one more event at the time being dispatched, ids are taken in order
+            bisect.insort(self.current, i, self.next_position())
+            return
+        bucket = self.buckets.get(tnext)
+        if bucket is None:
+            self.buckets[tnext] = [i]
+            heapq.heappush(self.times, tnext)
+        else:
+            bucket.append(i)
+
+    def next_position(self):
+        # index of the next id of the bucket being dispatched, list iterator has no index of its own,
+        # but it knows how many ids are left and the bucket may have grown
+        return len(self.current) - operator.length_hint(self.iterator)
+
+    def cancel(self, element):
+        self.planned[element.id] = NEVER
+
+    def peek(self):
+        times, buckets, planned = self.times, self.buckets, self.planned
+        while times:
+            tnext = times[0]
+            bucket = buckets[tnext]
+            bucket.sort()
+            k = 0
+            while k < len(bucket) and planned[bucket[k]] != tnext:
+                k += 1
+            if k == len(bucket):
+                del buckets[tnext]
+                heapq.heappop(times)
+                continue
+            del bucket[:k]
+            element = self.elements[bucket[0]]
+            if element.get_tnext() != tnext:
+                # element changed its tnext without calling schedule()
+                self.schedule(element, element.get_tnext())
+            else:
+                return tnext, element
+        return NEVER, None
+
+    def dispatch(self, tcurr):
+        # calls out_act_all of elements with an event at tcurr in order of ids, elements scheduled
+        # at tcurr meanwhile are called in the same pass, tcurr is the earliest time in the calendar
+        buckets, times, planned, elements = self.buckets, self.times, self.planned, self.elements
+        bucket = buckets.pop(tcurr, None)
+        if bucket is None:
+            return
+        heapq.heappop(times)
+        bucket.sort()
+        self.current = bucket
+        self.tcurr = tcurr
+
+        # schedule() inlined, the bucket of the last time is kept since most elements go to the same one
+        never = NEVER
+        last_time = None
+        append = None
+        # ids inserted after the current one by insort are reached by the same iteration,
+        # ids left by schedule() are not checked since out_act_all of their element does nothing
+        self.iterator = iterator = iter(bucket)
+        for i in iterator:
+            element = elements[i]
+            element.out_act_all(tcurr)
+            tnext = element.get_tnext()
+            if tnext != planned[i]:
+                planned[i] = tnext
+                if tnext != last_time:
+                    if tnext >= never:
+                        continue
+                    last_time = tnext
+                    next_bucket = buckets.get(tnext)
+                    if next_bucket is None:
+                        next_bucket = buckets[tnext] = []
+                        heapq.heappush(times, tnext)
+                    append = next_bucket.append
+                append(i)
+            elif tnext == tcurr:
+                # planned[i] is still tcurr, so schedule() did not insert it
+                bisect.insort(bucket, i, self.next_position())
+        self.current = None
+        self.tcurr = None
+        self.iterator = None
+
+
+class Monitor(Element):
+    # pseudo-element with its own events in the calendar, it observes the model and is not a part of it
+    def __init__(self, name, tnext = float(sys.maxsize)):
+        super().__init__(0, name)
+        self.tnext = tnext
+
+    def get_tnext(self):
+        return self.tnext
+
+    def out_act_all(self, tcurr_next = None):
+        if self.tnext == tcurr_next:
+            self.out_act()
+
+    def print_info(self):
+        pass
+
+
+class WarmUp(Monitor):
+    # resets statistics of the model at the given time
+    def __init__(self, time_warmup):
+        super().__init__('WarmUp', time_warmup)
+        self.warmup_time = time_warmup
+
+    def out_act(self):
+        self.model.reset_statistics()
+        self.tnext = float(sys.maxsize)
+
+
+class MserWarmUp(Monitor):
+    '''
+    Detects the end of the transient by MSER-batch rule on metric(model) sampled
+    every interval of model time. Sample means of batch samples form the series,
+    when there are at least min_batches of them truncation point d minimizing
+    MSER(d) = sum of squared deviations of batches after d / (n - d)^2 is found.
+    If d lies in the first half of the series, the transient is over: statistics
+    are reset at the current time (so everything up to the detection is dropped,
+    it is at least d batches) and warmup_time is set to the time of batch d.
+    Series is halved by merging neighbour batches when it reaches max_batches.
+    '''
+
+    def __init__(self, metric, interval, batch = 5, min_batches = 20, max_batches = 1000):
+        super().__init__('MserWarmUp', interval)
+        self.metric = metric
+        self.interval = interval
+        self.batch = batch
+        self.min_batches = min_batches
+        self.max_batches = max_batches
+
+        self.batches = []
+        self.batch_sum = 0.0
+        self.batch_count = 0
+        self.warmup_time = None
+        self.reset_time = None
+
+    @staticmethod
+    def truncation(values):
+        # d in [0, n / 2] minimizing MSER(d), suffix sums make it O(n)
+        values = np.asarray(values, dtype=float)
+        n = len(values)
+        suffix_sum = np.cumsum(values[::-1])[::-1]
+        suffix_squares = np.cumsum((values ** 2)[::-1])[::-1]
+        d = np.arange(n // 2 + 1)
+        count = n - d
+        deviations = suffix_squares[d] - suffix_sum[d] ** 2 / count
+        return int(d[np.argmin(deviations / count ** 2)])
+
+    def out_act(self):
+        self.batch_sum += self.metric(self.model)
+        self.batch_count += 1
+        self.tnext = self.tcurr + self.interval
+        if self.batch_count < self.batch:
+            return
+
+        self.batches.append(self.batch_sum / self.batch_count)
+        self.batch_sum = 0.0
+        self.batch_count = 0
+
+        n = len(self.batches)
+        if n >= self.min_batches:
+            d = MserWarmUp.truncation(self.batches)
+            if d < n // 2:
+                self.warmup_time = d * self.batch * self.interval
+                self.reset_time = self.tcurr
+                self.model.reset_statistics()
+                self.tnext = float(sys.maxsize)
+                return
+
+        if n >= self.max_batches:
+            merged = np.asarray(self.batches[:n - n % 2]).reshape(-1, 2).mean(axis=1)
+            self.batches = merged.tolist()
+            self.batch *= 2
+
+
+class Trace:
+    # event trace sink, record is called by the model after every processed event
+    def record(self, model, iteration):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class PrintTrace(Trace):
+    def record(self, model, iteration):
+        print(f'Event at {model.tcurr:.2f} time in {model.curr_element.name}')
+
+
+class DebugTrace(Trace):
+    # prints state of all elements after every event
+    def __init__(self, delay = 0.1):
+        self.delay = delay
+
+    def record(self, model, iteration):
+        model.print_result(iteration)
+        if self.delay > 0:
+            time.sleep(self.delay)
+
+
+class TextTrace(Trace):
+    # buffered text log, one line per event: iteration, time, element name
+    def __init__(self, path, buffer_size = 1 << 20):
+        self.file = open(path, 'w', buffering=buffer_size)
+
+    def record(self, model, iteration):
+        self.file.write(f'{iteration} {model.tcurr!r} {model.curr_element.name}\n')
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class BinaryTrace(Trace):
+    # fixed size records: iteration, time, element id
+    RECORD = struct.Struct('<qdi')
+
+    def __init__(self, path, buffer_size = 1 << 20):
+        self.file = open(path, 'wb', buffering=buffer_size)
+
+    def record(self, model, iteration):
+        self.file.write(BinaryTrace.RECORD.pack(iteration, model.tcurr, model.curr_element.id))
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    @staticmethod
+    def read(path):
+        with open(path, 'rb') as file:
+            return list(BinaryTrace.RECORD.iter_unpack(file.read()))
+
+
+class RingTrace(Trace):
+    # keeps only the last size events in memory
+    def __init__(self, size = 1000):
+        self.events = deque(maxlen=size)
+
+    def record(self, model, iteration):
+        self.events.append((iteration, model.tcurr, model.curr_element.name))
+
+    def print_events(self):
+        for iteration, tcurr, name in self.events:
+            print(f'Iteration: {iteration}, event at {tcurr:.2f} time in {name}')
+
+
+class Counters:
+    # call counters per element and wall time per phase of the simulate loop,
+    # elements get counting subclasses and model phases get timing wrappers only when enabled
+    METHODS = ('get_tnext', 'in_act', 'out_act', 'out_act_all', 'get_free_device', 'get_min_device',
+               'get_next_element_with_highest_priority')
+    PHASES = (('next event', 'find_next_event'), ('statistics', 'do_statistics'),
+              ('dispatch', 'dispatch'), ('trace', 'record_traces'))
+
+    _classes = {}
+
+    def __init__(self, model):
+        self.model = model
+        self.calls = []
+        self.phases = {phase: 0.0 for phase, _ in Counters.PHASES}
+        for element in model.elements:
+            self.add(element)
+
+        for phase, name in Counters.PHASES:
+            setattr(model, name, self.timed(phase, getattr(model, name)))
+
+    def add(self, element):
+        self.calls.append(dict.fromkeys(Counters.METHODS, 0))
+        element.__class__ = Counters.counted_class(type(element))
+
+    @staticmethod
+    def counted_class(cls):
+        if cls not in Counters._classes:
+            namespace = {'__slots__': (), 'counted_base': cls}
+            for name in Counters.METHODS:
+                if hasattr(cls, name):
+                    namespace[name] = Counters.counted(name, getattr(cls, name))
+            Counters._classes[cls] = type(cls.__name__, (cls,), namespace)
+        return Counters._classes[cls]
+
+    @staticmethod
+    def counted(name, method):
+        def wrapper(self, *args, **kwargs):
+            self.model.counters.calls[self.id][name] += 1
+            return method(self, *args, **kwargs)
+        return wrapper
+
+    def timed(self, phase, method):
+        phases = self.phases
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            result = method(*args, **kwargs)
+            phases[phase] += time.perf_counter() - start
+            return result
+        return wrapper
+
+    def report(self):
+        model = self.model
+        total = dict.fromkeys(Counters.METHODS, 0)
+        for calls in self.calls:
+            for name, count in calls.items():
+                total[name] += count
+
+        events = total['out_act']
+        calls = sum(total.values())
+        print(f'Iterations: {model.iterations}, events (out_act): {events}, tcurr: {model.tcurr:.2f}')
+        if model.tcurr > 0:
+            print(f'V (events per unit of time): {events / model.tcurr:.4f}')
+        if events > 0:
+            print(f'K (counted calls per event): {calls / events:.2f}, '
+                  f'device scans per event: {(total["get_free_device"] + total["get_min_device"]) / events:.2f}')
+
+        phases_total = sum(self.phases.values())
+        for phase, seconds in self.phases.items():
+            share = seconds / phases_total if phases_total > 0 else 0.0
+            print(f'\t{phase}: {seconds:.4f} s ({share:.1%})')
+
+        for element, calls in zip(model.elements, self.calls):
+            print(f'Name: {element.name}, \
+                  events: {calls["out_act"]}, \
+                  in_act: {calls["in_act"]}, \
+                  get_tnext: {calls["get_tnext"]}, \
+                  device scans: {calls["get_free_device"] + calls["get_min_device"]}, \
+                  routing decisions: {calls["get_next_element_with_highest_priority"]}')
 
 
 class Model:
-    def __init__(self, elements, debug = False):
+    def __init__(self, elements, debug = False, debug_delay = 0.1, calendar = 'heap', trace = None, counters = False,
+                 warmup = None, monitors = None):
+        if calendar not in ('heap', 'scan'):
+            raise ValueError(f'Unknown calendar: {calendar}, expected heap or scan')
+
         self.elements = elements
         self.delta = 0.0
         self.tnext = 0.0
         self.tcurr = 0.0
+        # statistics are collected from tstat, it is moved by reset_statistics
+        self.tstat = 0.0
         self.curr_element = None
+        # iterations of the simulate loop done so far, one per distinct event time
+        self.iterations = 0
+        self.started = False
         self.debug = debug
-    
-    def simulate(self, time_modeling, logging = True):
+        self.debug_delay = debug_delay
+
+        # trace sinks, nothing is done per event when the list is empty
+        if trace is None:
+            self.traces = []
+        elif isinstance(trace, Trace):
+            self.traces = [trace]
+        else:
+            self.traces = list(trace)
+        if debug:
+            self.traces.append(DebugTrace(debug_delay))
+
+        # monitors get events from the calendar after elements, warmup is time or a Monitor (MserWarmUp)
+        self.monitors = list(monitors) if monitors is not None else []
+        if warmup is not None:
+            self.monitors.append(warmup if isinstance(warmup, Monitor) else WarmUp(warmup))
+        self.scheduled = self.elements + self.monitors
+
+        for i, element in enumerate(self.scheduled):
+            element.id = i
+            element.model = self
+        # 'scan' is the old linear search over all elements, kept for comparison
+        self.calendar = EventCalendar(self.scheduled) if calendar == 'heap' else None
+
+        # elements still relying on per-event do_statistics calls
+        self.statistics_elements = [element for element in self.elements
+                                    if type(element).do_statistics is not Element.do_statistics]
+
+        self.counters = Counters(self) if counters else None
+
+    def reschedule(self, element):
+        if self.calendar is not None:
+            self.calendar.schedule(element, element.get_tnext())
+
+    def find_next_event(self):
+        if self.calendar is not None:
+            self.tnext, element = self.calendar.peek()
+            if element is not None:
+                self.curr_element = element
+            return
+
+        self.tnext = float(sys.maxsize)
+        for element in self.scheduled:
+            if element.get_tnext() < self.tnext:
+                self.tnext = element.get_tnext()
+                self.curr_element = element
+
+    def do_statistics(self):
+        for element in self.statistics_elements:
+            element.do_statistics(self.tnext - self.tcurr)
+
+    def dispatch(self):
+        if self.calendar is not None:
+            # only elements owning an event at tcurr are invoked, top of the calendar is validated by find_next_event
+            self.calendar.dispatch(self.tcurr)
+        else:
+            for element in self.scheduled:
+                element.out_act_all(self.tcurr)
+
+    def reset_statistics(self):
+        # end of warm-up, accumulators of all elements start again from tcurr
+        self.tstat = self.tcurr
+        for element in self.elements:
+            element.reset_statistics()
+
+    def record_traces(self, iteration):
+        for trace in self.traces:
+            trace.record(self, iteration)
+
+    def start(self):
+        # fills event calendar from tnext of elements
+        if self.calendar is not None:
+            self.calendar.clear()
+            for element in self.scheduled:
+                self.reschedule(element)
+        self.started = True
+
+    def __getstate__(self):
+        # counters, traces and the calendar are not a part of the model state,
+        # timing wrappers of counters are instance attributes shadowing the methods
+        state = dict(self.__dict__)
+        for _, name in Counters.PHASES:
+            state.pop(name, None)
+        state['counters'] = None
+        state['traces'] = []
+        state['calendar'] = self.calendar is not None
+        state['entity_ids'] = Entity.ids
+        # counted and profiled subclasses are pickled as the original class without profiler
+        for element in self.scheduled:
+            if type(element) is not Model.base_class(type(element)):
+                copyreg.pickle(type(element), Model.reduce_element)
+        return state
+
+    def __setstate__(self, state):
+        state = dict(state)
+        Entity.ids = max(state.pop('entity_ids'), Entity.ids)
+        self.__dict__.update(state)
+        # events are ordered by (tnext, element id), so the rebuilt calendar is the same
+        self.calendar = EventCalendar(self.scheduled) if state['calendar'] else None
+        if self.started:
+            self.start()
+
+    @staticmethod
+    def base_class(cls):
+        while 'profiled_base' in vars(cls) or 'counted_base' in vars(cls):
+            cls = vars(cls).get('profiled_base', vars(cls).get('counted_base'))
+        return cls
+
+    @staticmethod
+    def reduce_element(element):
+        _, _, state, *rest = object.__reduce_ex__(element, pickle.HIGHEST_PROTOCOL)
+        if isinstance(state, tuple) and state[1] is not None and state[1].get('profiler') is not None:
+            state = (state[0], {**state[1], 'profiler': None})
+        return (object.__new__, (Model.base_class(type(element)),), state, *rest)
+
+    def snapshot(self, compress = True):
+        # state of elements, queues, entities and their random streams, the default stream of Rand is not included
+        data = pickle.dumps(self, pickle.HIGHEST_PROTOCOL)
+        return zlib.compress(data, 1) if compress else data
+
+    @staticmethod
+    def restore(data):
+        # inverse of snapshot, compressed data starts with zlib header instead of pickle PROTO opcode
+        if data[:1] != b'\x80':
+            data = zlib.decompress(data)
+        return pickle.loads(data)
+
+    def fork(self, n, compress = False):
+        # n copies continuing from the current state, they go on with the same
+        # random streams (positions included), so branches differ only by changed parameters
+        data = self.snapshot(compress)
+        return [Model.restore(data) for _ in range(n)]
+
+    def save(self, path, compress = True):
+        # checkpoint of a long run, simulation is resumed by Model.load(path).simulate(...)
+        with open(path, 'wb') as file:
+            file.write(self.snapshot(compress))
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rb') as file:
+            return Model.restore(file.read())
+
+    def advance(self, time_until, inclusive = True):
+        # handles events up to time_until (excluded if not inclusive) and moves the clock there,
+        # elements changed from outside between calls have to call schedule()
+        if not self.started:
+            self.start()
+
+        statistics_elements = self.statistics_elements
+        traces = self.traces
         i = 0
-        while self.tcurr < time_modeling:
-            self.tnext = float(sys.maxsize)
-            for element in self.elements:
-                if element.get_tnext() < self.tnext:
-                    self.tnext = element.get_tnext()
-                    self.curr_element = element
-            
-            if logging:
-                print(f'Next event at {self.tnext:.2f} time in {self.curr_element.name}')
-
-            for element in self.elements:
-                element.do_statistics(self.tnext - self.tcurr)
-            
+        while True:
+            self.find_next_event()
+            if self.tnext > time_until or (not inclusive and self.tnext == time_until):
+                break
+            if statistics_elements:
+                self.do_statistics()
             self.tcurr = self.tnext
-            for element in self.elements:
-                element.tcurr = self.tcurr
+            self.dispatch()
+            if traces:
+                self.record_traces(self.iterations + i)
+            i += 1
 
-            for element in self.elements:
-                element.out_act_all(self.tcurr)
+        if time_until > self.tcurr:
+            self.tnext = time_until
+            if statistics_elements:
+                self.do_statistics()
+            self.tcurr = time_until
+        self.iterations += i
+
+    def simulate(self, time_modeling, logging = True):
+        self.start()
 
-            if self.debug:
-                self.print_result(i)
-                time.sleep(1)
+        statistics_elements = self.statistics_elements
+        traces = self.traces
+        i = 0
+        while self.tcurr < time_modeling:
+            self.find_next_event()
+            if statistics_elements:
+                self.do_statistics()
+            self.tcurr = self.tnext
+            self.dispatch()
+            if traces:
+                self.record_traces(i)
             i += 1
 
+        self.iterations += i
+        for trace in traces:
+            trace.flush()
+
         if logging:
             print('\n\nModeling finished!\n')
             self.print_result()
-    
+
     def print_result(self, iteration=None):
         if iteration is not None:
             print('\n\n')
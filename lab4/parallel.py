@@ -0,0 +1,336 @@
+import multiprocessing
+import sys
+import time
+from functools import partial
+from framework import *
+
+
+class Outbox(Element):
+    # stands for an element of another logical process in next_elements,
+    # arrivals become messages, routing sees priority and last published can_accept of the target
+    def __init__(self, target, priority, accepts):
+        super().__init__(0, f'Outbox({target})')
+        self.target = target
+        self.priority = priority
+        self.accepts = accepts
+        self.messages = []
+
+    def in_act(self, entity = None):
+        if entity is not None:
+            # pool of the sender stays in its process
+            entity.pool = None
+        self.messages.append((self.target, entity))
+
+    def get_priority(self):
+        return self.priority
+
+    def can_accept(self):
+        return self.accepts
+
+    def get_tnext(self):
+        return float(sys.maxsize)
+
+
+def collect_statistics(element):
+    # default summary of an element returned by ParallelModel.simulate
+    statistics = {'quantity': element.quantity}
+    if isinstance(element, Process):
+        statistics.update({
+            'failure': element.failure,
+            'mean_queue': element.get_mean_queue(),
+            'mean_load': element.get_mean_load(),
+        })
+    return statistics
+
+
+class LogicalProcess:
+    '''
+    Part of a model simulated by one worker. The whole model is built by
+    model_factory, elements of other parts are replaced in next_elements by
+    Outbox proxies and dropped, local elements (in order of their indices in
+    the whole model) form a sub-model.
+    '''
+
+    def __init__(self, model_factory, part, lookahead = None):
+        model = model_factory()
+        elements = model.elements if isinstance(model, Model) else list(model)
+        indices = {id(element): i for i, element in enumerate(elements)}
+        part = sorted(part)
+        local = set(part)
+
+        self.local = {i: elements[i] for i in part}
+        self.outboxes = {}
+        # local elements with remote successors, they bound the time of outgoing messages
+        self.boundary = []
+        # local elements which are targets of other parts, their can_accept is published
+        self.targets = []
+
+        for j, element in enumerate(elements):
+            if j not in local:
+                self.targets += [indices[id(next_element)] for next_element in element.next_elements
+                                 if indices[id(next_element)] in local]
+        self.targets = sorted(set(self.targets))
+
+        for i in part:
+            element = elements[i]
+            next_elements = []
+            for next_element in element.next_elements:
+                j = indices[id(next_element)]
+                if j in local:
+                    next_elements.append(next_element)
+                    continue
+                if j not in self.outboxes:
+                    self.outboxes[j] = Outbox(j, next_element.get_priority(), next_element.can_accept())
+                next_elements.append(self.outboxes[j])
+            if any(isinstance(next_element, Outbox) for next_element in next_elements):
+                self.boundary.append(element)
+            element.next_elements = next_elements
+
+        # minimum delay of a boundary element, new entity can not leave it sooner
+        if lookahead is None:
+            delays = [element.delayMean for element in self.boundary]
+            lookahead = min(delays) if delays and all(isinstance(delay, (int, float)) for delay in delays) else 0.0
+        self.lookahead = lookahead
+
+        # sub-model ids follow indices of the whole model, so events at the same time
+        # are handled in the same order as in the sequential model
+        self.indices = part
+        self.model = Model([self.local[i] for i in part])
+        # outboxes have no events, they only read the clock of the sub-model
+        for outbox in self.outboxes.values():
+            outbox.model = self.model
+
+    def report(self, time_due = None):
+        # due is the index of the first local element with an event at time_due
+        model = self.model
+        if not model.started:
+            model.start()
+        model.find_next_event()
+        boundary_next = min((element.get_tnext() for element in self.boundary), default=float('inf'))
+        due = self.indices[model.curr_element.id] if model.tnext == time_due else float('inf')
+        return {
+            'next': model.tnext,
+            'boundary_next': boundary_next,
+            'due': due,
+            'accepts': {i: self.local[i].can_accept() for i in self.targets},
+        }
+
+    def update_accepts(self, accepts):
+        for outbox in self.outboxes.values():
+            if outbox.target in accepts:
+                outbox.accepts = accepts[outbox.target]
+
+    def advance(self, time_until, accepts):
+        # events before time_until, no messages can be sent by them
+        self.update_accepts(accepts)
+        self.model.advance(time_until, inclusive=False)
+        return self.report(time_until)
+
+    def step(self, messages, bound, accepts):
+        '''
+        Handles messages and then local events at the current time of elements
+        with index below bound one by one, returns messages sent by them as
+        (sender index, target index, entity) and the new report.
+        '''
+        self.update_accepts(accepts)
+        model = self.model
+        for _, target, entity in messages:
+            if entity is None:
+                self.local[target].in_act()
+            else:
+                entity.move(self.local[target])
+            model.reschedule(self.local[target])
+
+        outgoing = []
+        while True:
+            model.find_next_event()
+            if model.tnext != model.tcurr or self.indices[model.curr_element.id] >= bound:
+                break
+            element = model.curr_element
+            element.out_act_all(model.tcurr)
+            model.reschedule(element)
+            for outbox in self.outboxes.values():
+                outgoing += [(self.indices[element.id], target, entity) for target, entity in outbox.messages]
+                outbox.messages = []
+        return outgoing, self.report(model.tcurr)
+
+    def finish(self, collect):
+        return {i: collect(element) for i, element in self.local.items()}
+
+
+def _run_worker(connection, model_factory, part, lookahead):
+    lp = LogicalProcess(model_factory, part, lookahead)
+    connection.send((lp.lookahead, lp.report()))
+    while True:
+        command, *args = connection.recv()
+        if command in ('advance', 'step'):
+            connection.send(getattr(lp, command)(*args))
+        elif command == 'finish':
+            connection.send(lp.finish(*args))
+            break
+    connection.close()
+
+
+class ParallelModel:
+    '''
+    Conservative parallel simulation of a model split into logical processes,
+    every one in its own OS process with its own sub-model.
+
+    Time advances in windows. In every window all logical processes handle
+    their events before W = min over processes of min(tnext of boundary
+    elements, next event + lookahead), lookahead is the minimum delayMean of
+    elements sending to other processes, so none of these events sends a
+    message. Events at W itself are handled in rounds in order of element
+    indices, the same order as in the sequential model: the process with the
+    lowest index due (or lowest sender index of a message to it) handles its
+    events below the lowest index due in other processes, messages are passed
+    to their targets before the next round. Routing to a remote element uses its
+    can_accept published at the last round. Delays of boundary elements have to
+    be at least lookahead, pass lookahead = 0 for random delays.
+
+    model_factory() has to build the same model in every worker, partition is a
+    list of lists of element indices, or number of parts cut in blocks of
+    consecutive indices (chains and branches of lab4 models are built in order).
+    '''
+
+    def __init__(self, model_factory, partition, lookahead = None, serial = False):
+        model = model_factory()
+        count = len(model.elements if isinstance(model, Model) else model)
+        if isinstance(partition, int):
+            bounds = [round(k * count / partition) for k in range(partition + 1)]
+            partition = [list(range(bounds[k], bounds[k + 1])) for k in range(partition)]
+        partition = [list(part) for part in partition if len(part) > 0]
+        if sorted(i for part in partition for i in part) != list(range(count)):
+            raise ValueError('Partition has to contain every element index exactly once')
+
+        self.model_factory = model_factory
+        self.partition = partition
+        self.owner = [0] * count
+        for k, part in enumerate(partition):
+            for i in part:
+                self.owner[i] = k
+        self.lookahead = lookahead
+        self.serial = serial
+        self.windows = 0
+        self.rounds = 0
+
+    def start(self):
+        if self.serial:
+            self.lps = [LogicalProcess(self.model_factory, part, self.lookahead)
+                        for part in self.partition]
+            return [(lp.lookahead, lp.report()) for lp in self.lps]
+
+        self.connections = []
+        self.workers = []
+        for part in self.partition:
+            parent, child = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=_run_worker,
+                                             args=(child, self.model_factory, part, self.lookahead))
+            worker.start()
+            self.connections.append(parent)
+            self.workers.append(worker)
+        return [connection.recv() for connection in self.connections]
+
+    def call(self, command, args):
+        # args is a list with arguments for every logical process
+        if self.serial:
+            return [getattr(lp, command)(*lp_args) for lp, lp_args in zip(self.lps, args)]
+        for connection, lp_args in zip(self.connections, args):
+            connection.send((command, *lp_args))
+        return [connection.recv() for connection in self.connections]
+
+    def call_one(self, k, command, args):
+        if self.serial:
+            return getattr(self.lps[k], command)(*args)
+        self.connections[k].send((command, *args))
+        return self.connections[k].recv()
+
+    def simulate(self, time_modeling, collect = collect_statistics, logging = True):
+        '''
+        Runs windows until every event with time <= time_modeling is handled,
+        returns dict of element index to collect(element).
+        '''
+        started = self.start()
+        lookaheads = [lookahead for lookahead, _ in started]
+        reports = [report for _, report in started]
+        count = len(self.partition)
+        accepts = {}
+
+        start = time.perf_counter()
+        while True:
+            for report in reports:
+                accepts.update(report['accepts'])
+            window = min(min(min(report['boundary_next'], report['next'] + lookahead)
+                             for report, lookahead in zip(reports, lookaheads)), time_modeling)
+
+            reports = self.call('advance', [(window, accepts)] * count)
+            self.windows += 1
+
+            # events at the window time in rounds ordered by element indices
+            pending = [[] for _ in range(count)]
+            while True:
+                keys = [min([report['due']] + [message[0] for message in messages])
+                        for report, messages in zip(reports, pending)]
+                k = min(range(count), key=keys.__getitem__)
+                if keys[k] == float('inf'):
+                    break
+                for report in reports:
+                    accepts.update(report['accepts'])
+                bound = min((key for j, key in enumerate(keys) if j != k), default=float('inf'))
+
+                outgoing, reports[k] = self.call_one(k, 'step', (pending[k], bound, accepts))
+                self.rounds += 1
+                pending[k] = []
+                for message in outgoing:
+                    pending[self.owner[message[1]]].append(message)
+
+            if window >= time_modeling:
+                break
+        seconds = time.perf_counter() - start
+
+        results = {}
+        for part_results in self.call('finish', [(collect,)] * count):
+            results.update(part_results)
+        if not self.serial:
+            for worker in self.workers:
+                worker.join()
+
+        if logging:
+            print(f'{count} logical processes, {self.windows} windows, {self.rounds} rounds, {seconds:.2f} s')
+        return dict(sorted(results.items()))
+
+
+def create_tie_model():
+    # p1 finishes at the same times p2 does, p2 without a queue fails every other arrival
+    create = Create(1, 'create')
+    process1 = Process(1, 'process1', 0)
+    process2 = Process(2, 'process2', 0)
+    create.next_elements = [process1]
+    process1.next_elements = [process2]
+    return Model([create, process1, process2])
+
+
+if __name__ == '__main__':
+    from benchmark import create_n_model_different_structure
+
+    # simultaneous events in different processes
+    model = create_tie_model()
+    model.advance(20)
+    sequential = {i: collect_statistics(element) for i, element in enumerate(model.elements)}
+    results = ParallelModel(create_tie_model, [[0, 1], [2]], serial=True).simulate(20)
+    print('same results as sequential with simultaneous events:', results == sequential)
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    time_modeling = 1000
+    model_factory = partial(create_n_model_different_structure, n)
+
+    start = time.perf_counter()
+    model = model_factory()
+    model.advance(time_modeling)
+    print(f'sequential: {time.perf_counter() - start:.2f} s')
+    sequential = {i: collect_statistics(element) for i, element in enumerate(model.elements)}
+
+    # create with the first branch, second branch
+    partition = [list(range(0, n // 2 + 1)), list(range(n // 2 + 1, n + 1))]
+    results = ParallelModel(model_factory, partition).simulate(time_modeling)
+    print('same results as sequential:', results == sequential)